@@ -0,0 +1,224 @@
+"""
+Benchmarks for parsing, diff-adaptation and end-to-end revision.
+
+Results are printed as JSON Lines, one record per measurement, for example:
+
+    python -m benchmarks.bench --sizes 1K,100K --revisions 1,3 > bench.jsonl
+
+By default, documents are 1 KB to 10 MB with 1 to 9 revisions, but diffadapt
+is only run up to 10 KB (--max-diff-size) and revise up to 1 MB
+(--max-revise-size) and copyaid's maximum of 7 revisions. Each run skipped by
+these caps is printed as a "skip" record.
+"""
+
+import copyaid.cli, copyaid.core
+from copyaid.core import SimpleParser
+from copyaid.diff import ENGINES, diffadapt
+
+# Python Standard Library
+import argparse, contextlib, io, json, platform, random, sys, tempfile, time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable
+
+COPYBREAK = "<!-- copybreak -->\n"
+MARKDOWN_FORMAT = {
+    "extensions": [".md"],
+    "copybreak": {"keywords": ["copybreak"], "prefix": "<!--", "suffix": "-->"},
+}
+WORDS = """
+    the planet of gas is a big and small Jupiter Saturn orbit sun moon ring
+    storm cloud large giant system solar around with by from through which
+    """.split()
+SUFFIXES = dict(K=2**10, M=2**20)
+
+
+def parse_size(text: str) -> int:
+    if text[-1:].upper() in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1:].upper()])
+    return int(text)
+
+
+def make_document(size: int, seed: int = 0, paragraphs_per_segment: int = 8) -> str:
+    """Markdown-ish text of about `size` characters with periodic copybreaks"""
+    rng = random.Random(seed)
+    parts = list()
+    total = 0
+    num_paragraphs = 0
+    while total < size:
+        lines = list()
+        for _ in range(rng.randint(2, 6)):
+            words = rng.choices(WORDS, k=rng.randint(6, 14))
+            lines.append(" ".join(words).capitalize() + ".\n")
+        paragraph = "".join(lines) + "\n"
+        num_paragraphs += 1
+        if num_paragraphs % paragraphs_per_segment == 0:
+            paragraph += COPYBREAK
+        parts.append(paragraph)
+        total += len(paragraph)
+    return "".join(parts)[:size]
+
+
+def make_revision(text: str, seed: int) -> str:
+    """Reflow lines and replace some words, roughly like a light copyedit"""
+    rng = random.Random(seed)
+    words = text.replace("\n", " ").split(" ")
+    for i in range(len(words)):
+        if rng.random() < 0.05:
+            words[i] = rng.choice(WORDS)
+    return " ".join(w for w in words if w) + "\n"
+
+
+def measure(func: Callable[[], Any], repeat: int) -> tuple[float, float]:
+    """Return best wall time in seconds and peak traced memory in MiB"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak / 2**20
+
+
+def record(bench: str, size: int, seconds: float, peak_mib: float, **extra: Any) -> None:
+    data = dict(
+        bench=bench,
+        size=size,
+        **extra,
+        seconds=round(seconds, 6),
+        mib_per_sec=round(size / 2**20 / seconds, 3) if seconds else None,
+        peak_mib=round(peak_mib, 3),
+    )
+    print(json.dumps(data), flush=True)
+
+
+def skip(bench: str, size: int, reason: str, **extra: Any) -> None:
+    data = dict(bench="skip", skipped=bench, size=size, **extra, reason=reason)
+    print(json.dumps(data), flush=True)
+
+
+def bench_parse(tmp_dir: Path, size: int, repeat: int) -> None:
+    src = tmp_dir / "parse.md"
+    src.write_text(make_document(size))
+    parser = SimpleParser.from_POD(MARKDOWN_FORMAT)
+    seconds, peak = measure(lambda: list(parser.parse(src).segments), repeat)
+    record("parse", size, seconds, peak)
+
+
+def bench_diffadapt(size: int, num_revs: int, engine: str, repeat: int) -> None:
+    orig = make_document(size).replace(COPYBREAK, "")
+    revisions = [make_revision(orig, seed) for seed in range(num_revs)]
+    seconds, peak = measure(lambda: diffadapt(orig, revisions, engine=engine), repeat)
+    record("diffadapt", size, seconds, peak, revisions=num_revs, engine=engine)
+
+
+class BenchApi:
+    """Stand-in for the OpenAI API returning `n` light copyedits of the source"""
+
+    def __init__(self, api_key: str | None):
+        pass
+
+    def query(self, req: dict[str, Any]) -> Any:
+        source = req["messages"][1]["content"]
+        choices = [
+            SimpleNamespace(message=SimpleNamespace(content=make_revision(source, i)))
+            for i in range(req.get("n", 1))
+        ]
+        return SimpleNamespace(created=0, choices=choices)
+
+
+def bench_revise(tmp_dir: Path, size: int, num_revs: int, repeat: int) -> None:
+    settings = tmp_dir / f"bench{num_revs}.toml"
+    settings.write_text(
+        'chat_system = "Copyedit."\n'
+        "max_tokens_ratio = 1.5\n"
+        "[openai]\n"
+        f"n = {num_revs}\n"
+    )
+    config = tmp_dir / "copyaid.toml"
+    config.write_text(f"[tasks.bench]\nrequest = '{settings}'\n")
+    src = tmp_dir / "revise.md"
+    src.write_text(make_document(size))
+    args = ["bench", str(src), "--dest", str(tmp_dir), "--config", str(config)]
+    args.append("--no-cache")
+    copyaid.core.ApiProxy.ApiClass = BenchApi  # type: ignore[assignment]
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, peak = measure(lambda: copyaid.cli.main(args), repeat)
+    record("revise", size, seconds, peak, revisions=num_revs)
+
+
+def main(cmd_line_args: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--bench",
+        default="parse,diffadapt,revise",
+        help="Comma separated benchmarks to run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="1K,10K,100K,1M,10M",
+        help="Comma separated document sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-diff-size",
+        default="10K",
+        help="Largest single segment for diffadapt benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-revise-size",
+        default="1M",
+        help="Largest document for revise benchmark (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--revisions",
+        default="1,3,5,7,9",
+        help="Comma separated numbers of revisions (default: %(default)s)",
+    )
+    parser.add_argument("--engine", choices=ENGINES, action="append")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(cmd_line_args)
+    benches = args.bench.split(",")
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    revisions = [int(n) for n in args.revisions.split(",")]
+    max_diff_size = parse_size(args.max_diff_size)
+    max_revise_size = parse_size(args.max_revise_size)
+    info = dict(
+        bench="info",
+        python=platform.python_version(),
+        argv=sys.argv[1:],
+        max_diff_size=max_diff_size,
+        max_revise_size=max_revise_size,
+        max_revise_revisions=copyaid.cli.MAX_NUM_REVS,
+    )
+    print(json.dumps(info), flush=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        for size in sizes:
+            if "parse" in benches:
+                bench_parse(tmp_dir, size, args.repeat)
+            if "diffadapt" in benches:
+                if size > max_diff_size:
+                    skip("diffadapt", size, "larger than --max-diff-size")
+                else:
+                    for engine in args.engine or ENGINES:
+                        for n in revisions:
+                            bench_diffadapt(size, n, engine, args.repeat)
+            if "revise" in benches:
+                if size > max_revise_size:
+                    skip("revise", size, "larger than --max-revise-size")
+                    continue
+                for n in revisions:
+                    if n > copyaid.cli.MAX_NUM_REVS:
+                        reason = "more revisions than copyaid saves"
+                        skip("revise", size, reason, revisions=n)
+                    else:
+                        bench_revise(tmp_dir, size, n, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,128 @@
+"""
+Offline batch workflow using OpenAI Batch API input and results files.
+
+`copyaid batch submit` saves every request for the sources in one JSON Lines
+batch input file. Once the batch has been run (uploaded through the OpenAI
+Files and Batches API), `copyaid batch collect` reads the results file and
+saves revisions as a normal run would, including running react commands.
+"""
+
+from .cli import (
+    do_works, make_task, make_works, parse_config_args, postconfig_argparser
+)
+from .core import OfflineApi, WorkFiles, error, warning
+from .replay import ReplayApi, replay_key
+from .task import Task
+
+# Python Standard Library
+import argparse, json
+from functools import partial
+from pathlib import Path
+from typing import Any, Iterable
+
+BATCH_URL = "/v1/chat/completions"
+MAX_BATCH_REQUESTS = 50000
+
+
+class BatchResultsApi(ReplayApi):
+    """
+    API answering queries from a batch results file, keyed on custom_id.
+    """
+
+    strict = True
+
+    def __init__(self, results_path: Path):
+        self.results_path = results_path
+        super().__init__(None)
+
+    def load_responses(self) -> dict[str, dict[str, Any]]:
+        ret = dict()
+        num_failed = 0
+        with open(self.results_path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code", 200) != 200:
+                    num_failed += 1
+                    continue
+                ret[result["custom_id"]] = response["body"]
+        if num_failed:
+            warning(f"{num_failed} failed requests in {self.results_path}")
+        return ret
+
+
+def save_batch(task: Task, works: Iterable[WorkFiles], path: Path) -> int:
+    """Save batch input file of distinct requests and return how many"""
+    keys = set()
+    with open(path, "w") as file:
+        for work in works:
+            for _, request in task.iter_requests(work):
+                key = replay_key(request)
+                if key not in keys:
+                    keys.add(key)
+                    line = dict(custom_id=key, method="POST", url=BATCH_URL)
+                    json.dump(line | dict(body=request), file)
+                    file.write("\n")
+    return len(keys)
+
+
+def batch_argparser(
+    action: str, task_names: Iterable[str], help_text: str
+) -> argparse.ArgumentParser:
+    parser = postconfig_argparser(task_names, help_text, estimate=False, stats=False)
+    parser.prog = "copyaid batch " + action
+    if action == "submit":
+        parser.description = "Save requests for sources in a batch input file."
+        parser.add_argument(
+            "-o",
+            "--output",
+            type=Path,
+            required=True,
+            metavar="<path>",
+            help="Batch input JSON Lines file to save"
+        )
+    else:
+        parser.description = "Save revisions from a batch results file."
+        parser.add_argument(
+            "--results",
+            type=Path,
+            required=True,
+            metavar="<path>",
+            help="Batch results JSON Lines file"
+        )
+    return parser
+
+
+def batch_main(cmd_line_args: list[str]) -> int:
+    action = cmd_line_args[0] if cmd_line_args else None
+    if action not in ("submit", "collect"):
+        error("Usage: copyaid batch {submit,collect} ...")
+        return 2
+    make_parser = partial(batch_argparser, action)
+    if not (parsed := parse_config_args(cmd_line_args[1:], make_parser)):
+        return 2
+    (config, args) = parsed
+    (works, missing) = make_works(args.source, args.dest, config.source_extensions)
+    if missing:
+        error(f"File not found: '{missing}'")
+        return 2
+    if action == "submit":
+        task = make_task(config, args, OfflineApi())
+        if not task.can_request:
+            error(f"Task '{args.task}' does not request revisions.")
+            return 2
+        try:
+            num_requests = save_batch(task, works, args.output)
+        finally:
+            task.close()
+        print(f"Saved {num_requests} requests to {args.output}")
+        if num_requests > MAX_BATCH_REQUESTS:
+            warning(f"Batches are limited to {MAX_BATCH_REQUESTS} requests.")
+        return 0
+    task = make_task(config, args, BatchResultsApi(args.results))
+    try:
+        return do_works(task, works, args.jobs)
+    finally:
+        task.close()
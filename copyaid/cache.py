@@ -0,0 +1,79 @@
+# Python Standard Library
+import hashlib, json, os, threading
+from pathlib import Path
+from typing import Any
+
+
+def request_key(request: dict[str, Any]) -> str:
+    data = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent cache of response choices keyed on a hash of the full request.
+
+    Least recently used entries are evicted when the total size of the cache
+    exceeds `max_bytes`. File modification times track recent use.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size: int | None = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / (key + ".json")
+
+    def get(self, request: dict[str, Any]) -> list[str] | None:
+        path = self._path(request_key(request))
+        try:
+            with open(path) as file:
+                choices = json.load(file)["choices"]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return list(choices)
+
+    def put(self, request: dict[str, Any], choices: list[str]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(request_key(request))
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(dict(model=request.get("model"), choices=choices), file)
+        with self._lock:
+            try:
+                # the size of a replaced entry no longer counts toward the total
+                old_size = path.stat().st_size
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = self._total_size()
+            else:
+                self._size += path.stat().st_size - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[os.DirEntry[str]]:
+        with os.scandir(self.cache_dir) as it:
+            return [e for e in it if e.name.endswith(".json")]
+
+    def _total_size(self) -> int:
+        return sum(e.stat().st_size for e in self._entries())
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime_ns)
+        self._size = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if self._size <= self.max_bytes:
+                break
+            self._size -= entry.stat().st_size
+            Path(entry.path).unlink(missing_ok=True)
@@ -1,37 +1,47 @@
-from .core import error, WorkFiles
+from .cache import ResponseCache
+from .core import OfflineApi, error, WorkFiles
 from .task import Config, Task
-from .util import get_std_path
+from .util import config_file_path, get_std_path
 
 # Python standard libraries
-import argparse, logging
+import argparse, json, logging, os, sys, time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterable
+from typing import Any, Callable, Iterable, Iterator
 
 PROGNAME = "copyaid"
 COPYAID_TMP_DIR = ("TMPDIR", "copyaid")
-COPYAID_CONFIG_FILENAME = "copyaid.toml"
-COPYAID_CONFIG_FILE = ("XDG_CONFIG_HOME", "copyaid/" + COPYAID_CONFIG_FILENAME)
 COPYAID_LOG_DIR = ("XDG_STATE_HOME", "copyaid/log")
+COPYAID_CACHE_DIR = ("XDG_CACHE_HOME", "copyaid/responses")
 MAX_NUM_REVS = 7
 
+ArgParserMaker = Callable[[Iterable[str], str], argparse.ArgumentParser]
 
-def get_config_path(cmd_line_args: list[str] | None) -> Path | None:
+
+def get_config_path(
+    cmd_line_args: list[str] | None, cwd: Path | None = None
+) -> Path | None:
     preparser = argparse.ArgumentParser(add_help=False)
     preparser.add_argument("-c", "--config", type=Path)
     (args, rest) = preparser.parse_known_args(cmd_line_args)
+    if args.config and cwd:
+        args.config = cwd / args.config
     if args.config and not args.config.exists():
         error(f"Config file '{args.config}' not found.")
         return None
-    ret = args.config or Path(get_std_path(*COPYAID_CONFIG_FILE))
-    if ret.is_dir():
-        ret = ret / COPYAID_CONFIG_FILENAME
-    return ret
+    return config_file_path(args.config)
 
 
 def postconfig_argparser(
-    task_names: Iterable[str], help_text: str
+    task_names: Iterable[str],
+    help_text: str,
+    parser_class: type[argparse.ArgumentParser] = argparse.ArgumentParser,
+    estimate: bool = True,
+    stats: bool = True,
 ) -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(
+    """Return parser of options after config, without options a command ignores"""
+    parser = parser_class(
         prog=PROGNAME,
         description="CopyAId",
         epilog=help_text,
@@ -51,58 +61,264 @@ def postconfig_argparser(
         metavar="<dest>",
         help="Destination directory for revisions"
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="<num>",
+        help="Number of source files to request revisions for at the same time"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use or save cached responses"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only request revisions for segments changed since the previous run"
+    )
+    if estimate:
+        parser.add_argument(
+            "--estimate",
+            action="store_true",
+            help="Estimate requests, tokens, cost and time without sending requests"
+        )
+    if stats:
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print time, token usage and cache hits by source and prompt"
+        )
+        parser.add_argument(
+            "--stats-json",
+            type=Path,
+            metavar="<path>",
+            help="Save time, token usage and cache hits by source and prompt as JSON"
+        )
+        parser.add_argument(
+            "--profile-startup",
+            action="store_true",
+            help="Print time taken by each startup phase to stderr"
+        )
     parser.add_argument("task", choices=task_names, metavar="<task>")
-    parser.add_argument("source", type=Path, nargs="+", metavar="<source>")
+    parser.add_argument(
+        "source",
+        type=Path,
+        nargs="+",
+        metavar="<source>",
+        help="Source file, or directory to search for files of configured formats"
+    )
     return parser
 
 
-def main(cmd_line_args: list[str] | None = None) -> int:
-    logging.basicConfig()
-    tmp_dir = Path(get_std_path(*COPYAID_TMP_DIR))
-    config_path = get_config_path(cmd_line_args)
-    if not config_path:
-        return 2
-    default_config = tmp_dir / "package"
+def load_config(config_path: Path) -> tuple[Config, str]:
+    default_config = Path(get_std_path(*COPYAID_TMP_DIR)) / "package"
     config = Config(default_config , config_path)
     help_text = (
         f"Default config: {default_config}/copyaid.toml\n" +
         f"User config: {config_path}\n\n" +
         config.help()
     )
-    parser = postconfig_argparser(config.task_names, help_text)
-    args = parser.parse_args(cmd_line_args)
+    return (config, help_text)
+
+
+def find_sources(src_dir: Path, extensions: Iterable[str]) -> Iterator[Path]:
+    """Walk directory in sorted order, skipping hidden files and directories"""
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.startswith(".") and os.path.splitext(name)[1] in extensions:
+                yield Path(root, name)
+
+
+def source_dest_name(src: Path) -> str:
+    return src.resolve().name if src.is_dir() else src.name
+
+
+def iter_works(
+    sources: list[Path], dest: Path, extensions: Iterable[str]
+) -> Iterator[WorkFiles]:
+    """Generate work files, mirroring directory trees under destinations"""
+    for src in sources:
+        dest_name = source_dest_name(src)
+        if not src.is_dir():
+            yield WorkFiles(src, f"{dest}/R{{}}/{dest_name}", MAX_NUM_REVS)
+            continue
+        for path in find_sources(src, extensions):
+            rel = path.relative_to(src)
+            yield WorkFiles(path, f"{dest}/R{{}}/{dest_name}/{rel}", MAX_NUM_REVS)
+
+
+def make_works(
+    sources: list[Path], dest: Path, extensions: Iterable[str] = ()
+) -> tuple[Iterator[WorkFiles], Path | None]:
+    """Return work files for sources up to the first missing source (if any)"""
+    missing = next((src for src in sources if not src.exists()), None)
+    if missing is not None:
+        sources = sources[: sources.index(missing)]
+    return (iter_works(sources, dest, set(extensions)), missing)
+
+
+class StartupProfile:
+    """Print time since the previous mark (and in total) for startup phases"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.start = self.stamp = time.perf_counter()
+
+    def mark(self, phase: str) -> None:
+        if self.enabled:
+            now = time.perf_counter()
+            msg = "startup: {:<16} {:8.2f} ms {:8.2f} ms total"
+            ms = (1000 * (now - self.stamp), 1000 * (now - self.start))
+            print(msg.format(phase, *ms), file=sys.stderr)
+            self.stamp = now
+
+
+def parse_config_args(
+    cmd_line_args: list[str],
+    make_parser: ArgParserMaker = postconfig_argparser,
+    profile: StartupProfile | None = None,
+) -> tuple[Config, argparse.Namespace] | None:
+    """Load config and parse arguments, or log an error and return None"""
+    profile = profile or StartupProfile(False)
+    config_path = get_config_path(cmd_line_args)
+    if not config_path:
+        return None
+    (config, help_text) = load_config(config_path)
+    profile.mark("load config")
+    args = make_parser(config.task_names, help_text).parse_args(cmd_line_args)
+    profile.mark("parse arguments")
     if args.dest is None:
-        args.dest = tmp_dir
-    exit_code = check_filename_collision(args.source)
-    if exit_code != 0:
-        return exit_code
-    task = config.get_task(args.task, get_std_path(*COPYAID_LOG_DIR))
-    for src in args.source:
-        if not src.exists():
-            error(f"File not found: '{src}'")
-            exit_code = 2
-            break
-        work = WorkFiles(src, str(args.dest) + "/R{}/" + src.name, MAX_NUM_REVS)
-        exit_code |= do_work(task, work)
-        if exit_code > 1:
-            break
+        args.dest = Path(get_std_path(*COPYAID_TMP_DIR))
+    if check_filename_collision(args.source) != 0:
+        return None
+    if args.jobs < 1:
+        error("Number of jobs must be at least 1.")
+        return None
+    return (config, args)
+
+
+def make_task(
+    config: Config,
+    args: argparse.Namespace,
+    api_client: Any = None,
+    map_files: bool = True,
+) -> Task:
+    """Make task of parsed arguments using the standard cache and log directories"""
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(get_std_path(*COPYAID_CACHE_DIR), config.cache_max_bytes)
+    log_path = get_std_path(*COPYAID_LOG_DIR)
+    return config.get_task(
+        args.task, log_path, cache, args.incremental, api_client, map_files
+    )
+
+
+def main(cmd_line_args: list[str] | None = None) -> int:
+    logging.basicConfig()
+    if cmd_line_args is None:
+        cmd_line_args = sys.argv[1:]
+    if cmd_line_args[:1] == ["serve"]:
+        from .server import serve_main
+
+        return serve_main(cmd_line_args[1:])
+    if cmd_line_args[:1] == ["batch"]:
+        from .batch import batch_main
+
+        return batch_main(cmd_line_args[1:])
+    if cmd_line_args[:1] == ["watch"]:
+        from .watch import watch_main
+
+        return watch_main(cmd_line_args[1:])
+    profile = StartupProfile("--profile-startup" in cmd_line_args)
+    if not (parsed := parse_config_args(cmd_line_args, profile=profile)):
+        return 2
+    (config, args) = parsed
+    api_client = OfflineApi() if args.estimate else None
+    task = make_task(config, args, api_client)
+    profile.mark("create task")
+    (works, missing) = make_works(args.source, args.dest, config.source_extensions)
+    if args.estimate:
+        from .estimate import estimate_run
+
+        if not task.can_request:
+            error(f"Task '{args.task}' does not request revisions.")
+            return 2
+        try:
+            print(estimate_run(config, task, works, args.jobs), end="")
+        finally:
+            task.close()
+        if missing:
+            error(f"File not found: '{missing}'")
+            return 2
+        return 0
+    try:
+        exit_code = do_works(task, works, args.jobs)
+    finally:
+        task.close()
+    cache = task.api.cache
+    if cache and cache.hits:
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    throttle = task.api.throttle
+    if throttle.throttled_seconds or throttle.num_retries:
+        msg = "Throttled for {:.1f} seconds with {} retries"
+        print(msg.format(throttle.throttled_seconds, throttle.num_retries))
+    if args.stats:
+        print(task.api.stats.table(), end="")
+    if args.stats_json:
+        data = task.api.stats.as_dict()
+        data["throttled_seconds"] = throttle.throttled_seconds
+        data["retries"] = throttle.num_retries
+        with open(args.stats_json, "w") as file:
+            json.dump(data, file, indent=4)
+            file.write("\n")
+    if missing and exit_code <= 1:
+        error(f"File not found: '{missing}'")
+        exit_code = 2
     return exit_code
 
 
 def check_filename_collision(sources: list[Path]) -> int:
     filenames = set()
     for s in sources:
-        if s.name in filenames:
+        name = source_dest_name(s)
+        if name in filenames:
             msg = "Sources must have unique filenames. Conflict: {}"
-            error(msg.format(s.name))
+            error(msg.format(name))
             return 2
-        filenames.add(s.name)
+        filenames.add(name)
     return 0
 
 
-def do_work(task: Task, work: WorkFiles) -> int:
-    if task.can_request:
+def do_works(task: Task, works: Iterable[WorkFiles], jobs: int) -> int:
+    """Overlap requests for up to `jobs` files, but react in file order."""
+    exit_code = 0
+    pool = ThreadPoolExecutor(jobs)
+    try:
+        queue: deque[tuple[WorkFiles, Future[None] | None]] = deque()
+        works_iter = iter(works)
+        while True:
+            while len(queue) < jobs and (work := next(works_iter, None)):
+                request = pool.submit(task.request, work) if task.can_request else None
+                queue.append((work, request))
+            if not queue:
+                break
+            exit_code |= do_work(task, *queue.popleft())
+            if exit_code > 1:
+                break
+    finally:
+        pool.shutdown(cancel_futures=True)
+        # identical requests are only shared within a run
+        task.api.clear_dedup()
+    return exit_code
+
+
+def do_work(task: Task, work: WorkFiles, request: Future[None] | None) -> int:
+    if request:
         print("Saving revisions to", work.dest_glob)
         print(" for source", work.src)
-        task.request(work)
+        request.result()
     return task.react(work)
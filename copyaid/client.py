@@ -0,0 +1,106 @@
+"""
+Thin client for a running `copyaid serve` server.
+
+Only light standard library modules are imported to connect, so that startup
+is fast. Revisions are requested by the server, which only returns the task
+name and the paths of saved revisions. React commands are read from the
+`tasks` and `commands` tables of the client's own config and run by the client,
+without importing the modules that request revisions.
+"""
+
+from .util import (
+    config_file_path, get_std_path, react_as_commands, read_package_bytes, run_react
+)
+
+# Python standard libraries
+import json, os, socket, struct, sys
+from pathlib import Path
+from typing import Any
+
+COPYAID_SOCKET = ("TMPDIR", "copyaid/server.sock")
+
+
+def socket_path() -> Path:
+    env = os.environ.get("COPYAID_SOCKET")
+    return Path(env) if env else get_std_path(*COPYAID_SOCKET)
+
+
+def check_socket_dir(path: Path) -> None:
+    """Raise PermissionError unless only the current user can change directory"""
+    st = os.stat(path)
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"Socket directory {path} is owned by another user")
+    if st.st_mode & 0o022:
+        raise PermissionError(f"Socket directory {path} is writable by other users")
+
+
+def check_peer(sock: socket.socket) -> None:
+    """Raise PermissionError if the other end of a Unix socket is another user"""
+    # without SO_PEERCRED, the socket directory check must suffice
+    if hasattr(socket, "SO_PEERCRED"):
+        size = struct.calcsize("3i")
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size)
+        (_, uid, _) = struct.unpack("3i", creds)
+        if uid != os.getuid():
+            raise PermissionError(f"Socket peer is another user (uid {uid})")
+
+
+def send_request(path: Path, request: dict[str, Any]) -> dict[str, Any]:
+    check_socket_dir(path.parent)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        check_peer(sock)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile("rb") as file:
+            data = file.read()
+    ret = json.loads(data)
+    assert isinstance(ret, dict)
+    return ret
+
+
+def react_commands(task_name: str, cmd_line_args: list[str]) -> list[str]:
+    """Return react commands of task, from the client's config"""
+    import argparse, tomli  # delay imports only needed to react
+
+    preparser = argparse.ArgumentParser(add_help=False)
+    preparser.add_argument("-c", "--config", type=Path)
+    (args, _) = preparser.parse_known_args(cmd_line_args)
+    data = tomli.loads(read_package_bytes("config/copyaid.toml").decode())
+    commands = data.get("commands", {})
+    task = data.get("tasks", {}).get(task_name)
+    config_path = config_file_path(args.config)
+    if config_path.exists():
+        with open(config_path, "rb") as file:
+            data = tomli.load(file)
+        commands.update(data.get("commands", {}))
+        task = data.get("tasks", {}).get(task_name, task)
+    return react_as_commands(task.get("react") if task else None, commands)
+
+
+def main(cmd_line_args: list[str] | None = None) -> int:
+    if cmd_line_args is None:
+        cmd_line_args = sys.argv[1:]
+    path = socket_path()
+    request = dict(cwd=os.getcwd(), args=cmd_line_args)
+    try:
+        response = send_request(path, request)
+    except OSError as ex:
+        print(f"Unable to connect to copyaid server at {path}: {ex}", file=sys.stderr)
+        return 2
+    sys.stdout.write(response["output"])
+    exit_code = 0
+    # the server has parsed the same arguments, so only works of valid ones are sent
+    works = response["works"]
+    react = react_commands(response["task"], cmd_line_args) if works else []
+    for work in works:
+        exit_code |= run_react(react, work["src"], work["revisions"])
+        if exit_code > 1:
+            break
+    if exit_code <= 1:
+        exit_code |= int(response["exit_code"])
+    return exit_code
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,12 +1,21 @@
+from copyaid.cache import ResponseCache, request_key
 from copyaid.diff import diffadapt
+from copyaid.logwriter import LOG_FORMATS, QueryLogWriter
+from copyaid.stats import RunStats
+from copyaid.throttle import AsyncThrottledApi, ThrottledApi
+from copyaid.tokens import estimate_text_tokens
 import tomli
 
 # Python Standard Library
-import filecmp, json, logging, os
+import filecmp, json, locale, logging, mmap, os, re, threading, time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+)
 from dataclasses import dataclass
-from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional, TextIO
+from types import SimpleNamespace
+from typing import Any, Iterable, Iterator, Optional, TextIO
 from typing_extensions import Protocol
 
 LOGGER = logging.getLogger('copyaid')
@@ -16,20 +25,88 @@ info = LOGGER.info
 debug = LOGGER.debug
 
 
+@dataclass
+class HttpSettings:
+    use_async: bool = False
+    base_url: str | None = None
+    timeout: float | None = None
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 5.0
+
+    def client_kwargs(self, use_async: bool) -> dict[str, Any]:
+        """Keyword arguments for OpenAI clients sharing a bounded connection pool"""
+        import httpx  # delay a slow import
+
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        client = httpx.AsyncClient if use_async else httpx.Client
+        ret: dict[str, Any] = dict(http_client=client(limits=limits))
+        if self.base_url:
+            ret["base_url"] = self.base_url
+        if self.timeout:
+            ret["timeout"] = self.timeout
+        return ret
+
+    @staticmethod
+    def from_POD(pod: dict[str, Any]) -> "HttpSettings":
+        ret = HttpSettings()
+        ret.use_async = bool(pod.get("async", ret.use_async))
+        ret.base_url = pod.get("base_url", ret.base_url)
+        ret.timeout = pod.get("timeout", ret.timeout)
+        ret.max_connections = int(pod.get("max_connections", ret.max_connections))
+        ret.max_keepalive_connections = int(
+            pod.get("max_keepalive_connections", ret.max_keepalive_connections)
+        )
+        ret.keepalive_expiry = pod.get("keepalive_seconds", ret.keepalive_expiry)
+        return ret
+
+
 class LiveOpenAiApi:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, http: HttpSettings | None = None):
         from openai import OpenAI  # delay a slow import
 
-        self.client = OpenAI(api_key=api_key)
+        kwargs = http.client_kwargs(use_async=False) if http else dict()
+        # retries are done by ThrottledApi
+        self.client = OpenAI(api_key=api_key, max_retries=0, **kwargs)
 
     def query(self, req: Any) -> Any:
         return self.client.chat.completions.create(**req)
 
 
+class LiveAsyncOpenAiApi:
+    def __init__(self, api_key: Optional[str] = None, http: HttpSettings | None = None):
+        from openai import AsyncOpenAI  # delay a slow import
+
+        kwargs = http.client_kwargs(use_async=True) if http else dict()
+        # retries are done by AsyncThrottledApi
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0, **kwargs)
+
+    async def query(self, req: Any) -> Any:
+        return await self.client.chat.completions.create(**req)
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+class OfflineApi:
+    """Stand-in for the API when requests are only inspected or saved, never sent"""
+
+    def __init__(self, api_key: Optional[str] = None):
+        pass
+
+    def query(self, req: Any) -> Any:
+        raise RuntimeError("Requests are not sent in offline mode")
+
+
 class PromptSettings:
     def __init__(self, path: Path):
         with open(path, "rb") as file:
             data = tomli.load(file)
+        self.path = path
         self.max_tokens_ratio = data["max_tokens_ratio"]
         self.system_prompt = data["chat_system"]
         self._openai = data.get("openai")
@@ -40,10 +117,15 @@ class PromptSettings:
     def num_revisions(self) -> int:
         return int(self._openai.get("n", 1)) if self._openai else 1
 
+    @property
+    def model(self) -> str | None:
+        return self._openai.get("model") if self._openai else None
+
     def make_openai_request(self, source: str) -> dict[str, Any]:
         assert isinstance(self._openai, dict)
         ret = dict(self._openai)
-        ret["max_tokens"] = max(32, int(self.max_tokens_ratio * len(source) / 4))
+        num_tokens = estimate_text_tokens(source, ret.get("model"))
+        ret["max_tokens"] = max(32, int(self.max_tokens_ratio * num_tokens))
         ret["messages"] = [
             {
                 "role": "system",
@@ -57,58 +139,307 @@ class PromptSettings:
         return ret
 
 
+class StreamedResponse:
+    """
+    Chat completion assembled from the chunks of a streamed response.
+    """
+
+    def __init__(self, chunks: Iterable[Any]):
+        contents: dict[int, list[str]] = dict()
+        self.created = 0
+        self.model = None
+        self.usage = None
+        for chunk in chunks:
+            self.created = chunk.created
+            self.model = getattr(chunk, "model", None)
+            self.usage = getattr(chunk, "usage", None) or self.usage
+            for c in chunk.choices:
+                contents.setdefault(c.index, []).append(c.delta.content or "")
+        self.choices = [
+            SimpleNamespace(index=i, message=SimpleNamespace(content="".join(parts)))
+            for i, parts in sorted(contents.items())
+        ]
+
+    def model_dump(self, **kwargs: Any) -> dict[str, Any]:
+        choices = [
+            dict(index=c.index, message=dict(role="assistant", content=c.message.content))
+            for c in self.choices
+        ]
+        ret = dict(created=self.created, model=self.model, choices=choices)
+        if self.usage is not None:
+            ret["usage"] = self.usage.model_dump()
+        return ret
+
+
+def read_response(response: Any) -> Any:
+    """Return response, after reading all its chunks if it is streamed"""
+    return response if hasattr(response, "choices") else StreamedResponse(response)
+
+
+async def aread_response(response: Any) -> Any:
+    if hasattr(response, "__aiter__"):
+        return StreamedResponse([chunk async for chunk in response])
+    return read_response(response)
+
+
 class ApiProxy:
     ApiClass = LiveOpenAiApi
 
     def __init__(
-        self, api_key: Optional[str], log_path: Path, log_format: Optional[str]
+        self,
+        api_key: Optional[str],
+        log_path: Path,
+        log_format: Optional[str],
+        api_client: Any = None,
+        http: HttpSettings | None = None,
     ):
         self.log_path = log_path
         self.log_format = log_format
-        self._api = ApiProxy.ApiClass(api_key)
-
-    def do_request(self, settings: PromptSettings, text: str, name: str) -> list[str]:
+        self.log_writer: QueryLogWriter | None = None
+        if log_format in LOG_FORMATS:
+            self.log_writer = QueryLogWriter(log_path, log_format)
+        elif log_format:
+            warning("Unsupported log format: {}".format(log_format))
+        self.cache: ResponseCache | None = None
+        self.stream = False
+        self.stats = RunStats()
+        if api_client is None:
+            api_client = self._make_api_client(api_key, http)
+        self.throttle = self._make_throttle(api_client)
+        self.max_dedup_entries = 4096
+        self._dedup: dict[str, Future[list[str]]] = dict()
+        self._dedup_lock = threading.Lock()
+
+    def _make_api_client(
+        self, api_key: Optional[str], http: HttpSettings | None
+    ) -> Any:
+        # substitute API classes only need to accept http settings if configured
+        if http:
+            return ApiProxy.ApiClass(api_key, http=http)
+        return ApiProxy.ApiClass(api_key)
+
+    def _make_throttle(self, api_client: Any) -> ThrottledApi:
+        return ThrottledApi(api_client)
+
+    def submit_request(
+        self,
+        pool: ThreadPoolExecutor,
+        settings: PromptSettings,
+        text: str,
+        name: str,
+        source: str | None = None,
+    ) -> Future[list[str]]:
+        return pool.submit(self.do_request, settings, text, name, source)
+
+    def do_request(
+        self, settings: PromptSettings, text: str, name: str, source: str | None = None
+    ) -> list[str]:
+        source = name if source is None else source
+        prompt = str(settings.path)
         request = settings.make_openai_request(text)
-        response = self._api.query(request)
-        self.log_openai_query(name, request, response)
+        # identical requests, from any source, are sent once and share the response
+        key = request_key(request)
+        with self._dedup_lock:
+            future = self._dedup.get(key)
+            if is_first := future is None:
+                future = self._dedup[key] = Future()
+                while len(self._dedup) > self.max_dedup_entries:
+                    del self._dedup[next(iter(self._dedup))]
+        if not is_first:
+            self.stats.add(source, prompt, dedup_hits=1)
+            return list(future.result())
+        try:
+            ret = self._do_request(request, name, source, prompt)
+        except BaseException as ex:
+            with self._dedup_lock:
+                self._dedup.pop(key, None)
+            future.set_exception(ex)
+            raise
+        future.set_result(ret)
+        return list(ret)
+
+    def clear_dedup(self) -> None:
+        """Forget requests of a run, so that later runs send them again"""
+        with self._dedup_lock:
+            self._dedup.clear()
+
+    def _do_request(
+        self, request: dict[str, Any], name: str, source: str, prompt: str
+    ) -> list[str]:
+        if self.cache:
+            if (cached := self.cache.get(request)) is not None:
+                self.stats.add(source, prompt, cache_hits=1)
+                return cached
+        query = self._make_query(request)
+        start = time.perf_counter()
+        # streams are read within the query so that errors reading them are retried
+        response = self.throttle.query(query, read_response)
+        seconds = time.perf_counter() - start
+        ret = self._save_response(query, response, name, source, prompt, seconds)
+        if self.cache:
+            self.cache.put(request, ret)
+        return ret
+
+    def _make_query(self, request: dict[str, Any]) -> dict[str, Any]:
+        if self.stream:
+            return dict(request, stream=True, stream_options={"include_usage": True})
+        return request
+
+    def _save_response(
+        self,
+        query: dict[str, Any],
+        response: Any,
+        name: str,
+        source: str,
+        prompt: str,
+        seconds: float,
+    ) -> list[str]:
+        self.stats.add(source, prompt, requests=1, request_seconds=seconds)
+        self.stats.add_usage(source, prompt, getattr(response, "usage", None))
+        self.log_openai_query(name, query, response)
         return [c.message.content for c in response.choices]
 
     def log_openai_query(self, name: str, request: Any, response: Any) -> None:
-        if not self.log_format:
-            return
-        t = datetime.utcfromtimestamp(response.created)
-        ts = t.isoformat().replace("-", "").replace(":", "") + "Z"
-        response_ex = {
-            'choices': {
-                '__all__': {
-                    'logprobs': {
-                        'content': {
-                            '__all__': {
-                                'bytes': True,
-                                'top_logprobs': {
-                                    0: True,
-                                    '__all__': {'bytes'},
-                                },
-                            }
-                        },
-                    },
-                }
-            },
-        }
-        response_dump = response.model_dump(exclude_unset=True, exclude=response_ex)
-        data = dict(request=request, response=response_dump)
-        os.makedirs(self.log_path, exist_ok=True)
-        save_stem = name + "." + ts
-        print("Logging OpenAI response", save_stem)
-        if self.log_format == "jsoml":
-            import jsoml
-            jsoml.dump(data, self.log_path / (save_stem + ".xml"))
-        elif self.log_format == "json":
-            with open(self.log_path / (save_stem + ".json"), "w") as file:
-                json.dump(data, file, indent=4, ensure_ascii=False)
-                file.write("\n")
-        else:
-            warning("Unsupported log format: {}".format(self.log_format))
+        if self.log_writer:
+            self.log_writer.put(name, request, response)
+
+    def close(self) -> None:
+        if self.log_writer:
+            self.log_writer.close()
+
+
+class AsyncApiProxy(ApiProxy):
+    """
+    API proxy sending requests from an event loop in one background thread.
+
+    Requests are not limited to a thread each. Up to `max_concurrency` requests
+    are sent at the same time, which by default is the HTTP connection limit.
+    The API class is selected with `ApiProxy.ApiClass`. The live OpenAI API is
+    replaced by its async version, while substitute API classes can have
+    either a sync or an async query method.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str],
+        log_path: Path,
+        log_format: Optional[str],
+        api_client: Any = None,
+        http: HttpSettings | None = None,
+    ):
+        import asyncio  # delay a slow import
+
+        super().__init__(api_key, log_path, log_format, api_client, http)
+        self.max_concurrency = (http or HttpSettings()).max_connections
+        self._semaphore: asyncio.Semaphore | None = None
+        self._async_dedup: dict[str, asyncio.Future[list[str]]] = dict()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def _make_api_client(
+        self, api_key: Optional[str], http: HttpSettings | None
+    ) -> Any:
+        api_class: Any = ApiProxy.ApiClass
+        if api_class is LiveOpenAiApi:
+            api_class = LiveAsyncOpenAiApi
+        if http:
+            return api_class(api_key, http=http)
+        return api_class(api_key)
+
+    def _make_throttle(self, api_client: Any) -> ThrottledApi:
+        return AsyncThrottledApi(api_client)
+
+    def _run_threadsafe(self, coro: Any) -> Future[Any]:
+        import asyncio  # delay a slow import
+
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def submit_request(
+        self,
+        pool: ThreadPoolExecutor,
+        settings: PromptSettings,
+        text: str,
+        name: str,
+        source: str | None = None,
+    ) -> Future[list[str]]:
+        return self._run_threadsafe(self.ado_request(settings, text, name, source))
+
+    def do_request(
+        self, settings: PromptSettings, text: str, name: str, source: str | None = None
+    ) -> list[str]:
+        coro = self.ado_request(settings, text, name, source)
+        return list(self._run_threadsafe(coro).result())
+
+    async def ado_request(
+        self, settings: PromptSettings, text: str, name: str, source: str | None = None
+    ) -> list[str]:
+        import asyncio  # delay a slow import
+
+        source = name if source is None else source
+        prompt = str(settings.path)
+        request = settings.make_openai_request(text)
+        # identical requests, from any source, are sent once and share the response
+        key = request_key(request)
+        if (future := self._async_dedup.get(key)) is not None:
+            self.stats.add(source, prompt, dedup_hits=1)
+            return list(await asyncio.shield(future))
+        future = self._async_dedup[key] = self._loop.create_future()
+        while len(self._async_dedup) > self.max_dedup_entries:
+            del self._async_dedup[next(iter(self._async_dedup))]
+        try:
+            ret = await self._ado_request(request, name, source, prompt)
+        except BaseException as ex:
+            self._async_dedup.pop(key, None)
+            if isinstance(ex, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(ex)
+                future.exception()  # avoid warnings when no identical request waits
+            raise
+        future.set_result(ret)
+        return list(ret)
+
+    def clear_dedup(self) -> None:
+        super().clear_dedup()
+        if self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._async_dedup.clear)
+
+    async def _ado_request(
+        self, request: dict[str, Any], name: str, source: str, prompt: str
+    ) -> list[str]:
+        import asyncio  # delay a slow import
+
+        # disk access of the cache is done off the event loop thread
+        if self.cache:
+            cached = await self._loop.run_in_executor(None, self.cache.get, request)
+            if cached is not None:
+                self.stats.add(source, prompt, cache_hits=1)
+                return cached
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        query = self._make_query(request)
+        async with self._semaphore:
+            start = time.perf_counter()
+            response = await self.throttle.query(query, aread_response)
+            seconds = time.perf_counter() - start
+        ret = self._save_response(query, response, name, source, prompt, seconds)
+        if self.cache:
+            await self._loop.run_in_executor(None, self.cache.put, request, ret)
+        return ret
+
+    async def _aclose(self) -> None:
+        if aclose := getattr(self.throttle._api, "aclose", None):
+            await aclose()
+        await self._loop.shutdown_default_executor()
+
+    def close(self) -> None:
+        if self._loop.is_running():
+            self._run_threadsafe(self._aclose()).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+        super().close()
 
 
 class WorkFiles:
@@ -118,6 +449,7 @@ class WorkFiles:
         dest = str(dest)
         self._dests = [Path(dest.format(i + 1)) for i in range(max_num_revs)]
         self.dest_glob = dest.format("?")
+        self.manifest_path = self._dests[0].with_name(f".{self.src.name}.copyaid.json")
         self._files: list[TextIO] = list()
 
     def revisions(self) -> list[Path]:
@@ -142,6 +474,20 @@ class WorkFiles:
             f.close()
         self._files = []
 
+    def read_manifest(self) -> dict[str, list[str]]:
+        """Read revised text of segments saved by a previous run."""
+        try:
+            with open(self.manifest_path) as file:
+                ret = json.load(file)
+        except (OSError, ValueError):
+            return dict()
+        return ret if isinstance(ret, dict) else dict()
+
+    def write_manifest(self, manifest: dict[str, list[str]]) -> None:
+        os.makedirs(self.manifest_path.parent, exist_ok=True)
+        with open(self.manifest_path, "w") as file:
+            json.dump(manifest, file, ensure_ascii=False)
+
 
 @dataclass
 class Copybreak:
@@ -164,15 +510,29 @@ class TextSegment:
 
 
 class ParsedSource:
-    def __init__(self) -> None:
-        self.segments: list[TextSegment] = list()
+    """
+    Segments of a source, which parsers can generate lazily as the source is read.
+
+    Parsers that generate segments lazily provide the set of instructions up front
+    so that segments only need to be iterated once.
+    """
+
+    def __init__(
+        self,
+        segments: Iterable[TextSegment] = (),
+        instructions: set[str] | None = None,
+    ):
+        self.segments = segments
+        self._instructions = instructions
 
     def instructions(self) -> set[str]:
-        ret = set()
-        for seg in self.segments:
-            if seg.copybreak and seg.copybreak.instruction:
-                ret.add(seg.copybreak.instruction)
-        return ret
+        if self._instructions is None:
+            self.segments = list(self.segments)
+            self._instructions = set()
+            for seg in self.segments:
+                if seg.copybreak and seg.copybreak.instruction:
+                    self._instructions.add(seg.copybreak.instruction)
+        return set(self._instructions)
 
 
 class SourceParserProtocol(Protocol):
@@ -189,11 +549,9 @@ def parse_source(parsers: list[SourceParserProtocol], src: Path) -> ParsedSource
 
 class TrivialParser:
     def parse(self, src_path: Path) -> ParsedSource | None:
-        ret = ParsedSource()
         warning(f"No file format configured for: {src_path}")
         with open(src_path) as file:
-            ret.segments.append(TextSegment(None, file.read()))
-        return ret
+            return ParsedSource([TextSegment(None, file.read())])
 
 
 @dataclass
@@ -202,7 +560,7 @@ class CopybreakSyntax:
     prefix: str
     suffix: str | None
 
-    def parse(self, line: str) -> Copybreak | None:
+    def parse(self, line: str, quiet: bool = False) -> Copybreak | None:
         s = line.strip()
         if not s.startswith(self.prefix):
             return None
@@ -215,39 +573,102 @@ class CopybreakSyntax:
         candidate = Copybreak(line, s.split())
         if candidate.keyword not in self.keywords:
             return None
-        if idx < 0:
+        if idx < 0 and not quiet:
             warning("Copybreak line missing suffix '{}'".format(self.suffix))
         return candidate
 
+    def compile(self, encoding: str) -> re.Pattern[bytes]:
+        """Regex matching at least the prefix and keyword of every copybreak line"""
+        keywords = b"|".join(re.escape(k.encode(encoding)) for k in self.keywords)
+        prefix = re.escape(self.prefix.encode(encoding))
+        # starting with a literal lets the regex engine skip quickly to candidates,
+        # which are then checked by `parse` (with Unicode whitespace)
+        return re.compile(rb"%s[^\n\r]*?(?:%s)" % (prefix, keywords))
+
     @staticmethod
     def from_POD(pod: dict[str, Any]) -> "CopybreakSyntax":
         return CopybreakSyntax(pod["keywords"], pod["prefix"], pod.get("suffix"))
 
 
+NEWLINE = re.compile(rb"\r\n|\r|\n")
+
+
+def decode_text(data: bytes, encoding: str) -> str:
+    """Decode like reading a file in text mode with universal newlines"""
+    ret = data.decode(encoding)
+    if "\r" in ret:
+        ret = ret.replace("\r\n", "\n").replace("\r", "\n")
+    return ret
+
+
+def read_source(src: Path, map_file: bool = True) -> bytes | mmap.mmap:
+    """Memory map file contents, or read them if the file can not be mapped"""
+    with open(src, "rb") as file:
+        if map_file:
+            try:
+                # the map stays valid after the file is closed
+                return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # empty files and pipes can not be mapped
+                pass
+        return file.read()
+
+
 class SimpleParser:
     def __init__(self, copybreak: CopybreakSyntax):
         self.copybreak = copybreak
         self.extensions_filter: list[str] | None = None
+        self.encoding = locale.getpreferredencoding(False)
+        # long-running processes read files, since a mapped file that is
+        # truncated while parsed raises SIGBUS
+        self.map_files = True
+        self._pattern = copybreak.compile(self.encoding)
 
     def parse(self, src: Path) -> ParsedSource | None:
         if self.extensions_filter is not None:
             if src.suffix not in self.extensions_filter:
                 return None
-        ret = ParsedSource()
-        pending_copybreak = None
-        pending_lines: list[str] = list()
-        with open(src) as file:
-            for line in file:
-                if new_copybreak := self.copybreak.parse(line):
-                    segment = TextSegment(pending_copybreak, "".join(pending_lines))
-                    ret.segments.append(segment)
-                    pending_copybreak = new_copybreak
-                    pending_lines = list()
-                else:
-                    pending_lines.append(line)
-            segment = TextSegment(pending_copybreak, "".join(pending_lines))
-            ret.segments.append(segment)
-        return ret
+        # instructions and segments are found in the same contents of the file
+        buf = read_source(src, self.map_files)
+        return ParsedSource(self.iter_segments(buf), self.scan_instructions(buf))
+
+    def find_copybreaks(
+        self, buf: bytes | mmap.mmap, quiet: bool = False
+    ) -> Iterator[tuple[int, int, Copybreak]]:
+        """Generate start and end offsets of copybreak lines in buffer"""
+        end = 0
+        for match in self._pattern.finditer(buf):
+            # lines end like universal newlines in text mode: \n, \r\n or \r
+            i = match.start()
+            start = buf.rfind(b"\n", 0, i) + 1
+            start = buf.rfind(b"\r", start, i) + 1 or start
+            if start < end:
+                continue
+            newline = NEWLINE.search(buf, match.end())
+            end = newline.end() if newline else len(buf)
+            line = decode_text(buf[start:end], self.encoding)
+            if copybreak := self.copybreak.parse(line, quiet):
+                yield (start, end, copybreak)
+
+    def scan_instructions(self, buf: bytes | mmap.mmap) -> set[str]:
+        """Find copybreak instructions without building any segments"""
+        return {
+            cb.instruction
+            for _, _, cb in self.find_copybreaks(buf, quiet=True) if cb.instruction
+        }
+
+    def iter_segments(self, buf: bytes | mmap.mmap) -> Iterator[TextSegment]:
+        try:
+            (pending_copybreak, offset) = (None, 0)
+            for start, end, copybreak in self.find_copybreaks(buf):
+                text = decode_text(buf[offset:start], self.encoding)
+                yield TextSegment(pending_copybreak, text)
+                (pending_copybreak, offset) = (copybreak, end)
+            text = decode_text(buf[offset:], self.encoding)
+            yield TextSegment(pending_copybreak, text)
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
 
     @staticmethod
     def from_POD(pod: dict[str, Any]) -> "SimpleParser":
@@ -256,10 +677,67 @@ class SimpleParser:
         return ret
 
 
+def estimate_num_tokens(text: str, model: str | None = None) -> int:
+    return int(estimate_text_tokens(text, model))
+
+
+def split_chunks(
+    text: str, max_tokens: int | None, model: str | None = None
+) -> list[str]:
+    """Split text at paragraph boundaries into chunks within a token budget"""
+    if max_tokens is None or estimate_num_tokens(text, model) <= max_tokens:
+        return [text]
+    ret = list()
+    chunk = paragraph = ""
+    # tokens of a chunk are counted as the sum of the tokens of its paragraphs
+    chunk_tokens = 0.0
+    prev_blank = False
+    for line in text.splitlines(keepends=True):
+        blank = not line.strip()
+        if prev_blank and not blank:
+            paragraph_tokens = estimate_text_tokens(paragraph, model)
+            if chunk and chunk_tokens + paragraph_tokens > max_tokens:
+                ret.append(chunk)
+                (chunk, chunk_tokens) = ("", 0.0)
+            chunk += paragraph
+            chunk_tokens += paragraph_tokens
+            paragraph = ""
+        paragraph += line
+        prev_blank = blank
+    if chunk and chunk_tokens + estimate_text_tokens(paragraph, model) > max_tokens:
+        ret.append(chunk)
+        chunk = ""
+    ret.append(chunk + paragraph)
+    return ret
+
+
+def stitch_chunks(chunks: list[str], revised_chunks: list[str]) -> str:
+    """Join revised chunks keeping the original whitespace between chunks"""
+    if len(chunks) == 1:
+        return revised_chunks[0]
+    ret = list()
+    for chunk, rev in zip(chunks, revised_chunks):
+        ret.append(rev.rstrip() + chunk[len(chunk.rstrip()):])
+    return "".join(ret)
+
+
+def timed_diffadapt(text: str, revisions: list[str]) -> tuple[list[str], float]:
+    """Return diff-adapted revisions and the CPU time taken by this thread"""
+    start = time.thread_time()
+    ret = diffadapt(text, revisions)
+    return (ret, time.thread_time() - start)
+
+
 class CopyEditor:
     def __init__(self, api: ApiProxy):
         self.api = api
         self.parsers: list[SourceParserProtocol] = []
+        self.max_concurrency = 1
+        self.incremental = False
+        self.max_chunk_tokens: int | None = None
+        self.max_diff_processes = 1
+        self._diff_pool: Executor | None = None
+        self._diff_pool_lock = threading.Lock()
         self._instructions: dict[str, PromptSettings | None] = dict()
 
     @property
@@ -297,28 +775,166 @@ class CopyEditor:
                         warning(msg.format(ret, instr.num_revisions, iid))
         return ret
 
-    def revise(self, work: WorkFiles) -> None:
+    @staticmethod
+    def _trim_revisions(revisions: list[str], num_revisions: int) -> list[str]:
+        if len(revisions) > num_revisions:
+            revisions = revisions[:num_revisions]
+        elif len(revisions) == 1 and num_revisions > 1:
+            revisions = list(revisions[0]) * num_revisions
+        assert len(revisions) == num_revisions
+        return revisions
+
+    def _submit_diffadapt(
+        self, text: str, revisions: list[str], source: str
+    ) -> Future[list[str]]:
+        ret = Future[list[str]]()
+
+        def done(timed: Future[tuple[list[str], float]]) -> None:
+            try:
+                (adapted, seconds) = timed.result()
+            except BaseException as ex:
+                ret.set_exception(ex)
+                return
+            self.api.stats.add(source, diffadapt_seconds=seconds)
+            ret.set_result(adapted)
+
+        if self.max_diff_processes > 1:
+            from concurrent.futures import ProcessPoolExecutor  # delay a slow import
+            from multiprocessing import get_context
+
+            # revise can be called from several threads at the same time
+            with self._diff_pool_lock:
+                if self._diff_pool is None:
+                    self._diff_pool = ProcessPoolExecutor(
+                        self.max_diff_processes, mp_context=get_context("spawn")
+                    )
+                diff_pool = self._diff_pool
+            timed = diff_pool.submit(timed_diffadapt, text, revisions)
+            timed.add_done_callback(done)
+        else:
+            timed = Future()
+            timed.set_result(timed_diffadapt(text, revisions))
+            done(timed)
+        return ret
+
+    def _write_segment(
+        self,
+        work: WorkFiles,
+        manifest: dict[str, list[str]],
+        seg: TextSegment,
+        key: str | None,
+        future: Future[list[str]],
+    ) -> None:
+        revisions = future.result()
+        for ri, rev in enumerate(revisions):
+            if seg.copybreak:
+                work.write_dest(seg.copybreak.raw_line, ri)
+            work.write_dest(rev, ri)
+        if key:
+            manifest[key] = revisions
+
+    def close(self) -> None:
+        with self._diff_pool_lock:
+            (diff_pool, self._diff_pool) = (self._diff_pool, None)
+        if diff_pool:
+            diff_pool.shutdown()
+        self.api.close()
+
+    def iter_requests(self, work: WorkFiles) -> Iterator[tuple[str, dict[str, Any]]]:
+        """Generate log names and requests that revising would send, sending none"""
         parsed = parse_source(self.parsers, work.src)
+        self._num_revisions(parsed)
+        cur_settings = self._instructions.get("")
+        for si, seg in enumerate(parsed.segments):
+            if seg.copybreak and seg.copybreak.instruction:
+                cur_settings = self._instructions[seg.copybreak.instruction]
+            if cur_settings and len(seg.text.strip()):
+                max_tokens = self.max_chunk_tokens
+                texts = split_chunks(seg.text, max_tokens, cur_settings.model)
+                for ci, text in enumerate(texts):
+                    log_name = "{}.{}".format(work.src.stem, si)
+                    if len(texts) > 1:
+                        log_name += ".{}".format(ci)
+                    yield (log_name, cur_settings.make_openai_request(text))
+
+    def revise(self, work: WorkFiles) -> None:
+        source = str(work.src)
+        stats = self.api.stats
+        with stats.timer(source, "parse_seconds"):
+            parsed = parse_source(self.parsers, work.src)
         num_revisions = self._num_revisions(parsed)
+        # in incremental mode, segments revised in the previous run are reused
+        previous = work.read_manifest() if self.incremental else dict()
+        manifest: dict[str, list[str]] = dict()
         work.open_new_dests(num_revisions)
         cur_settings = self._instructions.get("")
-        for si, seg in enumerate(parsed.segments):
-            if seg.copybreak:
-                for ri in range(num_revisions):
-                    work.write_dest(seg.copybreak.raw_line, ri)
-                if seg.copybreak.instruction:
+        # requests are sent up to max_concurrency at a time,
+        # but revisions are always written in segment order
+        pool = ThreadPoolExecutor(self.max_concurrency)
+        pending = list()
+        try:
+            segments = stats.timed_iter(source, "parse_seconds", parsed.segments)
+            for si, seg in enumerate(segments):
+                if seg.copybreak and seg.copybreak.instruction:
                     cur_settings = self._instructions[seg.copybreak.instruction]
-            log_name = "{}.{}".format(work.src.stem, si)
-            if cur_settings and len(seg.text.strip()):
-                revisions = self.api.do_request(cur_settings, seg.text, log_name)
-                if len(revisions) > num_revisions:
-                    revisions = revisions[:num_revisions]
-                elif len(revisions) == 1 and num_revisions > 1:
-                    revisions = list(revisions[0]) * num_revisions
-                assert len(revisions) == num_revisions
-                revisions = diffadapt(seg.text, revisions)
-            else:
-                revisions = [seg.text] * num_revisions
-            for ri, rev in enumerate(revisions):
-                work.write_dest(rev, ri)
+                key = None
+                chunks: list[tuple[str, Future[list[str]]]] = list()
+                if cur_settings and len(seg.text.strip()):
+                    if self.incremental:
+                        request = cur_settings.make_openai_request(seg.text)
+                        key = "{}.{}".format(request_key(request), num_revisions)
+                    if key not in previous:
+                        texts = split_chunks(
+                            seg.text, self.max_chunk_tokens, cur_settings.model
+                        )
+                        for ci, text in enumerate(texts):
+                            log_name = "{}.{}".format(work.src.stem, si)
+                            if len(texts) > 1:
+                                log_name += ".{}".format(ci)
+                            args = (cur_settings, text, log_name, source)
+                            future = self.api.submit_request(pool, *args)
+                            chunks.append((text, future))
+                pending.append((seg, key, chunks))
+            # segments can be diff-adapted in worker processes while requests complete
+            adapted: deque[tuple[TextSegment, str | None, Future[list[str]]]] = deque()
+            for seg, key, chunks in pending:
+                # save adapted segments while waiting for requests of this segment
+                waiting = [f for _, f in chunks if not f.done()]
+                while adapted and waiting:
+                    wait(waiting + [adapted[0][2]], return_when=FIRST_COMPLETED)
+                    while adapted and adapted[0][2].done():
+                        self._write_segment(work, manifest, *adapted.popleft())
+                    waiting = [f for f in waiting if not f.done()]
+                if chunks:
+                    texts = [text for text, _ in chunks]
+                    results = [
+                        self._trim_revisions(future.result(), num_revisions)
+                        for _, future in chunks
+                    ]
+                    revisions = [
+                        stitch_chunks(texts, [r[ri] for r in results])
+                        for ri in range(num_revisions)
+                    ]
+                    future = self._submit_diffadapt(seg.text, revisions, source)
+                else:
+                    future = Future[list[str]]()
+                    if key:
+                        future.set_result(previous[key])
+                    else:
+                        future.set_result([seg.text] * num_revisions)
+                adapted.append((seg, key, future))
+                while adapted and adapted[0][2].done():
+                    self._write_segment(work, manifest, *adapted.popleft())
+            while adapted:
+                self._write_segment(work, manifest, *adapted.popleft())
+        except BaseException:
+            # requests sent by an async API proxy are not cancelled by the pool
+            for _, _, chunks in pending:
+                for _, future in chunks:
+                    future.cancel()
+            raise
+        finally:
+            pool.shutdown(cancel_futures=True)
         work.close_dests()
+        if self.incremental:
+            work.write_manifest(manifest)
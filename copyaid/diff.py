@@ -1,13 +1,149 @@
 # Python Standard Library
 import difflib, re
+from array import array
 
-from typing import Iterator, Optional
+from collections.abc import Hashable, Sequence
+from typing import Any, Callable, Iterator, Optional
 
 ###############################################################################
 # Code that "diff-adapts" altered text to be more diff-friendly with original
 ###############################################################################
 
 Tokens = list[str]
+Block = tuple[int, int, int]
+Opcode = tuple[str, int, int, int, int]
+
+
+class AutomatonSequenceMatcher:
+    """
+    Drop-in for the parts of difflib.SequenceMatcher used here (with autojunk off)
+
+    The longest matching block of a range is found with a suffix automaton
+    of the second sequence range, rather than difflib's dynamic programming
+    over all pairs of matching elements, which is the slow part on long texts.
+    Blocks, tie-breaking and junk handling are the same as difflib.
+    """
+
+    def __init__(self, isjunk: Callable[[Any], bool]):
+        self.isjunk = isjunk
+        self.a: Sequence[Hashable] = []
+        self.b: Sequence[Hashable] = []
+        self.bjunk: list[bool] = []
+
+    def set_seq1(self, a: Sequence[Hashable]) -> None:
+        self.a = a
+
+    def set_seq2(self, b: Sequence[Hashable]) -> None:
+        self.b = b
+        self.bjunk = [self.isjunk(x) for x in b]
+
+    def find_longest_match(self, alo: int, ahi: int, blo: int, bhi: int) -> Block:
+        a, b, bjunk = self.a, self.b, self.bjunk
+        # suffix automaton of b[blo:bhi] with junk as unique unmatchable tokens
+        trans: list[dict[Hashable, int]] = [{}]
+        link = [-1]
+        length = [0]
+        first_end = [-1]
+        last = 0
+        for j in range(blo, bhi):
+            t = (None, j) if bjunk[j] else b[j]
+            cur = len(length)
+            trans.append({})
+            link.append(0)
+            length.append(length[last] + 1)
+            first_end.append(j)
+            p = last
+            while p != -1 and t not in trans[p]:
+                trans[p][t] = cur
+                p = link[p]
+            if p != -1:
+                q = trans[p][t]
+                if length[p] + 1 == length[q]:
+                    link[cur] = q
+                else:
+                    clone = len(length)
+                    trans.append(dict(trans[q]))
+                    link.append(link[q])
+                    length.append(length[p] + 1)
+                    first_end.append(first_end[q])
+                    while p != -1 and trans[p].get(t) == q:
+                        trans[p][t] = clone
+                        p = link[p]
+                    link[q] = clone
+                    link[cur] = clone
+            last = cur
+        # longest match ending at each position of a, earliest in a then in b
+        besti, bestj, bestsize = alo, blo, 0
+        state, size = 0, 0
+        for i in range(alo, ahi):
+            t = a[i]
+            while state and t not in trans[state]:
+                state = link[state]
+                size = length[state]
+            if t in trans[state]:
+                state = trans[state][t]
+                size += 1
+                if size > bestsize:
+                    besti, bestj, bestsize = i - size + 1, first_end[state] - size + 1, size
+            else:
+                state, size = 0, 0
+        # extend with junk on both sides, same as difflib
+        while besti > alo and bestj > blo and bjunk[bestj - 1] and \
+                a[besti - 1] == b[bestj - 1]:
+            besti, bestj, bestsize = besti - 1, bestj - 1, bestsize + 1
+        while besti + bestsize < ahi and bestj + bestsize < bhi and \
+                bjunk[bestj + bestsize] and a[besti + bestsize] == b[bestj + bestsize]:
+            bestsize += 1
+        return (besti, bestj, bestsize)
+
+    def get_matching_blocks(self) -> list[Block]:
+        la, lb = len(self.a), len(self.b)
+        queue = [(0, la, 0, lb)]
+        blocks = []
+        while queue:
+            alo, ahi, blo, bhi = queue.pop()
+            i, j, k = x = self.find_longest_match(alo, ahi, blo, bhi)
+            if k:
+                blocks.append(x)
+                if alo < i and blo < j:
+                    queue.append((alo, i, blo, j))
+                if i + k < ahi and j + k < bhi:
+                    queue.append((i + k, ahi, j + k, bhi))
+        blocks.sort()
+        ret = []
+        i1 = j1 = k1 = 0
+        for i2, j2, k2 in blocks:
+            if i1 + k1 == i2 and j1 + k1 == j2:
+                k1 += k2
+            else:
+                if k1:
+                    ret.append((i1, j1, k1))
+                i1, j1, k1 = i2, j2, k2
+        if k1:
+            ret.append((i1, j1, k1))
+        ret.append((la, lb, 0))
+        return ret
+
+    def get_opcodes(self) -> list[Opcode]:
+        i = j = 0
+        ret = []
+        for ai, bj, size in self.get_matching_blocks():
+            tag = ""
+            if i < ai and j < bj:
+                tag = "replace"
+            elif i < ai:
+                tag = "delete"
+            elif j < bj:
+                tag = "insert"
+            if tag:
+                ret.append((tag, i, ai, j, bj))
+            i, j = ai + size, bj + size
+            if size:
+                ret.append(("equal", ai, i, bj, j))
+        return ret
+
+
+ENGINES = ("automaton", "difflib")
 
 
 class TokenSequenceMatcher:
@@ -15,46 +151,93 @@ class TokenSequenceMatcher:
     # just an opaque token object to represent end-of-message for matching algo
     EOM = "just-random-a0f75a980e88b9c27fa02ed5b8def537d131f281"
 
-    def __init__(self, focal_text: str):
-        isjunk = lambda x: x == " "
-        self.matcher = difflib.SequenceMatcher(isjunk, autojunk=False)
+    def __init__(self, focal_text: str, engine: str = ENGINES[0]):
+        # tokens are interned as integer IDs with compact arrays for matching
+        self._vocab = [TokenSequenceMatcher.EOM, " "]
+        self._ids = {token: i for i, token in enumerate(self._vocab)}
         self.re_token = re.compile(r"\w+|\W|\n")
-        self.focus = self.tokenize(focal_text) + [TokenSequenceMatcher.EOM]
+        self.focus = self.intern(focal_text)
+        self._init_matcher(engine)
+
+    def _init_matcher(self, engine: str) -> None:
+        self.engine = engine
+        isjunk: Callable[[int], bool] = lambda x: x == 1  # ID of " "
         # SequenceMatcher: ... caches detailed information about the second sequence,
         # so if you want to compare one sequence against many sequences,
         # use set_seq2() ...
-        self.matcher.set_seq2(self.focus)
+        self.matcher: difflib.SequenceMatcher[int] | AutomatonSequenceMatcher
+        if engine == "difflib":
+            self.matcher = difflib.SequenceMatcher(
+                isjunk, array("i"), self.focus, autojunk=False
+            )
+        elif engine == "automaton":
+            self.matcher = AutomatonSequenceMatcher(isjunk)
+            self.matcher.set_seq2(self.focus)
+        else:
+            raise ValueError(f"Unknown diff engine '{engine}'")
+
+    def __getstate__(self) -> tuple[list[str], "array[int]", str]:
+        # only the tokenized focal text is pickled, the matcher is rebuilt
+        return (self._vocab, self.focus, self.engine)
+
+    def __setstate__(self, state: tuple[list[str], "array[int]", str]) -> None:
+        self._vocab, self.focus, engine = state
+        self._ids = {token: i for i, token in enumerate(self._vocab)}
+        self.re_token = re.compile(r"\w+|\W|\n")
+        self._init_matcher(engine)
 
     def tokenize(self, text: str) -> Tokens:
         return [match[0] for match in self.re_token.finditer(text)]
 
+    def intern(self, text: str) -> "array[int]":
+        """Token IDs of text followed by end-of-message"""
+        ret = array("i")
+        for match in self.re_token.finditer(text):
+            token = match[0]
+            if (tid := self._ids.get(token)) is None:
+                tid = self._ids[token] = len(self._vocab)
+                self._vocab.append(token)
+            ret.append(tid)
+        ret.append(0)
+        return ret
+
     def set_alternative(self, alt_text: str) -> None:
-        self.alt = self.tokenize(alt_text) + [TokenSequenceMatcher.EOM]
+        self.alt = self.intern(alt_text)
         self.matcher.set_seq1(self.alt)
 
     def operations(self) -> Iterator[tuple[str, Tokens, Tokens]]:
         """tag meaning is relative to going from alt text to focal text"""
 
+        alt, focus = memoryview(self.alt), memoryview(self.focus)
+        vocab = self._vocab
         return (
-            (tag, self.alt[a1:a2], self.focus[f1:f2])
+            (tag, [vocab[t] for t in alt[a1:a2]], [vocab[t] for t in focus[f1:f2]])
             for tag, a1, a2, f1, f2 in self.matcher.get_opcodes()
         )
 
 
 class DiffAdaptor:
     def __init__(self) -> None:
-        self.last_token: Optional[str] = None
+        # output tokens, the last of which can still be adapted
+        self.out: Tokens = list()
         self.line_debt = 0
 
+    @property
+    def last_token(self) -> Optional[str]:
+        return self.out[-1] if self.out else None
+
+    @last_token.setter
+    def last_token(self, token: str) -> None:
+        self.out[-1] = token
+
     @staticmethod
     def apply_operations(matcher: TokenSequenceMatcher) -> str:
-        tokens = []
         adaptor = DiffAdaptor()
         # ops for converting revised text back to orig
         for tag, rev_chunk, orig_chunk in matcher.operations():
-            tokens += adaptor._do_operation(tag, rev_chunk, orig_chunk)
-        assert adaptor.last_token == TokenSequenceMatcher.EOM
-        return "".join(tokens)
+            adaptor._do_operation(tag, rev_chunk, orig_chunk)
+        assert adaptor.out.pop() == TokenSequenceMatcher.EOM
+        return "".join(adaptor.out)
 
     def _do_operation(self, tag: str, rev: Tokens, orig: Tokens) -> Tokens:
         assert rev or orig
@@ -69,10 +252,7 @@ class DiffAdaptor:
                 if self._undo_delete(orig):
                     self.line_debt -= orig.count("\n")
                     ret = orig
-        if ret:
-            if self.last_token is not None:
-                ret.insert(0, self.last_token)
-            self.last_token = ret.pop()
+        self.out.extend(ret)
         return ret
 
     def _undo_delete(self, orig: Tokens) -> bool:
@@ -127,22 +307,53 @@ class DiffAdaptor:
         return rev
 
 
+def adapt_revision(
+    matcher: TokenSequenceMatcher,
+    orig_text: str,
+    rev_text: str,
+    codeword: Optional[str] = None,
+) -> str:
+    if codeword == rev_text.strip():
+        return orig_text
+    if not rev_text.endswith("\n"):
+        rev_text += "\n"
+    matcher.set_alternative(rev_text)
+    return DiffAdaptor.apply_operations(matcher)
+
+
+# state of diffadapt worker processes, tokenized original is shared by all revisions
+_worker_args: tuple[TokenSequenceMatcher, str, Optional[str]] | None = None
+
+
+def _init_worker(matcher: TokenSequenceMatcher, orig: str, codeword: str | None) -> None:
+    global _worker_args
+    _worker_args = (matcher, orig, codeword)
+
+
+def _adapt_revision_in_worker(rev_text: str) -> str:
+    assert _worker_args
+    (matcher, orig_text, codeword) = _worker_args
+    return adapt_revision(matcher, orig_text, rev_text, codeword)
+
+
 def diffadapt(
     orig_text: str,
     revisions: list[str],
     codeword: Optional[str] = None,
+    engine: str = ENGINES[0],
+    jobs: int = 1,
 ) -> list[str]:
-    ret = []
-    matcher = TokenSequenceMatcher(orig_text)
-    for rev_text in revisions:
-        if codeword == rev_text.strip():
-            ret.append(orig_text)
-        else:
-            if not rev_text.endswith("\n"):
-                rev_text += "\n"
-            matcher.set_alternative(rev_text)
-            ret.append(DiffAdaptor.apply_operations(matcher))
-    return ret
+    matcher = TokenSequenceMatcher(orig_text, engine)
+    if jobs > 1 and len(revisions) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            min(jobs, len(revisions)),
+            initializer=_init_worker,
+            initargs=(matcher, orig_text, codeword),
+        ) as pool:
+            return list(pool.map(_adapt_revision_in_worker, revisions))
+    return [adapt_revision(matcher, orig_text, rev, codeword) for rev in revisions]
 
 
 def cli(cmd_line_args: Optional[list[str]] = None) -> int:
@@ -154,6 +365,14 @@ def cli(cmd_line_args: Optional[list[str]] = None) -> int:
     parser.add_argument("src")
     parser.add_argument("rev", nargs="+")
     parser.add_argument("-c", "--codeword", help="Codeword for no changes.")
+    parser.add_argument(
+        "-e", "--engine", choices=ENGINES, default=ENGINES[0],
+        help="Sequence matching implementation."
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Number of processes to diff-adapt revisions with."
+    )
     args = parser.parse_args(cmd_line_args)
     with open(args.src) as file:
         source_text = file.read()
@@ -161,7 +380,9 @@ def cli(cmd_line_args: Optional[list[str]] = None) -> int:
     for rev in args.rev:
         with open(rev) as file:
             rev_texts.append(file.read())
-    rev_texts = diffadapt(source_text, rev_texts, args.codeword)
+    rev_texts = diffadapt(
+        source_text, rev_texts, args.codeword, args.engine, args.jobs
+    )
     for i, rev in enumerate(args.rev):
         with open(rev, "w") as file:
             file.write(rev_texts[i])
@@ -0,0 +1,140 @@
+"""
+Dry-run estimates of the requests, tokens, cost and time of a run.
+"""
+
+from .cache import request_key
+from .core import AsyncApiProxy, WorkFiles
+from .task import Config, Task
+from .tokens import estimate_text_tokens
+
+# Python Standard Library
+import io
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+
+@dataclass
+class RequestEstimate:
+    name: str
+    input_tokens: int
+    output_tokens: int
+    seconds: float
+
+
+class RunEstimate:
+    def __init__(self, config: Config):
+        self.prices = config.prices
+        self.tokens_per_second = config.estimate_tokens_per_second
+        self.request_seconds = config.estimate_request_seconds
+        self.requests: list[RequestEstimate] = list()
+        self.num_duplicates = 0
+        self.reserved_tokens = 0
+        self.rate_limit_tokens = 0
+        self.cost: float | None = 0.0
+        self.unpriced_models: set[str] = set()
+        self._keys: set[str] = set()
+
+    def add(self, name: str, request: dict[str, Any]) -> None:
+        key = request_key(request)
+        if key in self._keys:
+            # identical requests are only sent once
+            self.num_duplicates += 1
+            return
+        self._keys.add(key)
+        model = request.get("model")
+        n = int(request.get("n", 1))
+        messages = request.get("messages", [])
+        message_tokens = [estimate_text_tokens(m["content"], model) for m in messages]
+        input_tokens = sum(message_tokens)
+        # copyedited text is about as long as the source text
+        source_tokens = message_tokens[-1]
+        max_tokens = request.get("max_tokens", source_tokens)
+        choice_tokens = int(min(source_tokens, max_tokens))
+        seconds = self.request_seconds + choice_tokens / self.tokens_per_second
+        estimate = RequestEstimate(name, int(input_tokens), choice_tokens * n, seconds)
+        self.requests.append(estimate)
+        reserved_tokens = int(request.get("max_tokens", 0)) * n
+        self.reserved_tokens += reserved_tokens
+        # as counted against rate limits by throttle.estimate_tokens
+        self.rate_limit_tokens += int(input_tokens) + reserved_tokens
+        price = self.prices.get(model or "")
+        if price is None:
+            self.unpriced_models.add(str(model))
+            self.cost = None
+        elif self.cost is not None:
+            self.cost += int(input_tokens) * price.get("input", 0) / 1e6
+            self.cost += choice_tokens * n * price.get("output", 0) / 1e6
+
+    def wall_seconds(
+        self, concurrency: int, rate_limit: dict[str, Any]
+    ) -> tuple[float, str]:
+        """Return estimated wall time and what limits it"""
+        if not self.requests:
+            return (0.0, "no requests")
+        total = sum(r.seconds for r in self.requests)
+        bounds = [
+            (total / concurrency, f"concurrency {concurrency}"),
+            (max(r.seconds for r in self.requests), "slowest request"),
+        ]
+        if rpm := rate_limit.get("requests_per_minute"):
+            bounds.append((60 * len(self.requests) / rpm, f"{rpm} requests/minute"))
+        if tpm := rate_limit.get("tokens_per_minute"):
+            bounds.append((60 * self.rate_limit_tokens / tpm, f"{tpm} tokens/minute"))
+        return max(bounds)
+
+    def report(
+        self,
+        num_sources: int,
+        concurrency: int,
+        rate_limit: dict[str, Any],
+        top: int = 5,
+    ) -> str:
+        buf = io.StringIO()
+        input_tokens = sum(r.input_tokens for r in self.requests)
+        output_tokens = sum(r.output_tokens for r in self.requests)
+        buf.write(f"Sources: {num_sources}\n")
+        buf.write(f"Requests: {len(self.requests)}")
+        buf.write(f" ({self.num_duplicates} duplicates not sent)\n")
+        buf.write(f"Input tokens: {input_tokens}\n")
+        buf.write(f"Output tokens: {output_tokens}")
+        buf.write(f" (max_tokens reserved: {self.reserved_tokens})\n")
+        if self.cost is not None:
+            buf.write(f"Cost: ${self.cost:.4f}\n")
+        else:
+            models = ", ".join(sorted(self.unpriced_models))
+            buf.write(f"Cost: unknown, no prices configured for {models}\n")
+        (seconds, limit) = self.wall_seconds(concurrency, rate_limit)
+        buf.write(f"Wall time: {format_seconds(seconds)} (limited by {limit})\n")
+        slowest = sorted(self.requests, key=lambda r: -r.seconds)[:top]
+        if slowest:
+            buf.write("Slowest requests:\n")
+            for r in slowest:
+                buf.write(f"  {r.name}: {r.input_tokens} input tokens, ")
+                buf.write(f"{format_seconds(r.seconds)}\n")
+        return buf.getvalue()
+
+
+def format_seconds(seconds: float) -> str:
+    (minutes, seconds) = divmod(round(seconds), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    if hours:
+        return f"{hours}h {minutes:02}m {seconds:02}s"
+    return f"{minutes}m {seconds:02}s" if minutes else f"{seconds}s"
+
+
+def estimate_run(
+    config: Config, task: Task, works: Iterable[WorkFiles], jobs: int
+) -> str:
+    """Return report estimating requests, tokens, cost and time of a run"""
+    estimate = RunEstimate(config)
+    num_sources = 0
+    for work in works:
+        num_sources += 1
+        for name, request in task.iter_requests(work):
+            estimate.add(name, request)
+    if isinstance(task.api, AsyncApiProxy):
+        # requests of all jobs share one event loop and its connection limit
+        concurrency = task.api.max_concurrency
+    else:
+        concurrency = config.max_concurrent_requests * jobs
+    return estimate.report(num_sources, concurrency, config.rate_limit)
@@ -0,0 +1,144 @@
+"""
+Background saving of logged API requests and responses.
+"""
+
+# Python Standard Library
+import gzip, json, logging, os, queue, threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, TextIO
+
+LOGGER = logging.getLogger("copyaid")
+LOG_FORMATS = ("json", "jsoml", "jsonl", "jsonl.gz")
+JSONL_STEM = "copyaid"
+
+# exclude bulky log probability details from saved responses
+RESPONSE_EXCLUDE = {
+    'choices': {
+        '__all__': {
+            'logprobs': {
+                'content': {
+                    '__all__': {
+                        'bytes': True,
+                        'top_logprobs': {
+                            0: True,
+                            '__all__': {'bytes'},
+                        },
+                    }
+                },
+            },
+        }
+    },
+}
+
+
+def timestamp(created: int) -> str:
+    t = datetime.utcfromtimestamp(created)
+    return t.isoformat().replace("-", "").replace(":", "") + "Z"
+
+
+class QueryLogWriter:
+    """
+    Save logs of queries in a background thread, off the request path.
+
+    The "json" and "jsoml" formats save a file per query. The "jsonl" and
+    "jsonl.gz" formats append batches of queries to one JSON Lines file which
+    is rotated once larger than `max_bytes`, keeping `backups` older files.
+    """
+
+    def __init__(self, log_path: Path, log_format: str):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"Unsupported log format: {log_format}")
+        self.log_path = log_path
+        self.log_format = log_format
+        self.max_bytes = 64 * 2**20
+        self.backups = 5
+        self._queue: queue.Queue[tuple[str, Any, Any] | None] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, name: str, request: Any, response: Any) -> None:
+        self._queue.put((name, request, response))
+
+    def close(self) -> None:
+        """Save all queued logs and stop the background thread"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self) -> None:
+        done = False
+        while not done:
+            batch: list[tuple[str, Any, Any]] = list()
+            items = [self._queue.get()]
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            for item in items:
+                if item is None:
+                    done = True
+                    break
+                batch.append(item)
+            self._save(batch)
+
+    def _save(self, batch: list[tuple[str, Any, Any]]) -> None:
+        if not batch:
+            return
+        try:
+            os.makedirs(self.log_path, exist_ok=True)
+        except OSError as ex:
+            LOGGER.warning(f"Logging failed: {ex!r}")
+            return
+        records = list()
+        for name, request, response in batch:
+            # one bad record does not stop the others from being logged
+            try:
+                if record := self._save_record(name, request, response):
+                    records.append(record)
+            except Exception as ex:
+                LOGGER.warning(f"Logging {name} failed: {ex!r}")
+        if records:
+            try:
+                with self._open_jsonl() as file:
+                    file.write("".join(records))
+                self._rotate()
+            except Exception as ex:
+                LOGGER.warning(f"Logging failed: {ex!r}")
+
+    def _save_record(self, name: str, request: Any, response: Any) -> str | None:
+        """Save log file of query, or return JSON Lines record to append"""
+        dump = response.model_dump(exclude_unset=True, exclude=RESPONSE_EXCLUDE)
+        save_stem = name + "." + timestamp(response.created)
+        data = dict(request=request, response=dump)
+        if self.log_format == "jsoml":
+            import jsoml
+
+            print("Logging OpenAI response", save_stem)
+            jsoml.dump(data, self.log_path / (save_stem + ".xml"))
+        elif self.log_format == "json":
+            print("Logging OpenAI response", save_stem)
+            with open(self.log_path / (save_stem + ".json"), "w") as file:
+                json.dump(data, file, indent=4, ensure_ascii=False)
+                file.write("\n")
+        else:
+            return json.dumps(dict(name=save_stem, **data)) + "\n"
+        return None
+
+    def _jsonl_path(self, index: int = 0) -> Path:
+        stem = f"{JSONL_STEM}.{index}" if index else JSONL_STEM
+        return self.log_path / f"{stem}.{self.log_format}"
+
+    def _open_jsonl(self) -> TextIO:
+        path = self._jsonl_path()
+        if self.log_format.endswith(".gz"):
+            # each batch is appended as a separate gzip member
+            return gzip.open(path, "at", encoding="utf-8")
+        return open(path, "a", encoding="utf-8")
+
+    def _rotate(self) -> None:
+        if self._jsonl_path().stat().st_size < self.max_bytes:
+            return
+        for i in range(self.backups, 0, -1):
+            older = self._jsonl_path(i - 1)
+            if older.exists():
+                os.replace(older, self._jsonl_path(i))
+        self._jsonl_path().unlink(missing_ok=True)
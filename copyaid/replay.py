@@ -0,0 +1,127 @@
+"""
+Answer API queries from responses saved in query logs, with no network access.
+
+Select replay like any other API class, for example:
+
+    copyaid.core.ApiProxy.ApiClass = replay_api_class(log_dir, strict=True)
+"""
+
+from .cache import request_key
+from .core import HttpSettings, LiveOpenAiApi
+from .logwriter import JSONL_STEM
+
+# Python Standard Library
+import gzip, json, re, threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+# request keys only used for streaming do not change responses
+STREAM_KEYS = ("stream", "stream_options")
+ROTATED_LOG_NAME = re.compile(re.escape(JSONL_STEM) + r"\.(\d+)\.jsonl(\.gz)?")
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+def replay_key(request: dict[str, Any]) -> str:
+    return request_key({k: v for k, v in request.items() if k not in STREAM_KEYS})
+
+
+def log_age_key(path: Path) -> tuple[int, int]:
+    """Sort key ordering log files from oldest to newest"""
+    # rotated logs keep their modification times, and higher numbers are older
+    match = ROTATED_LOG_NAME.fullmatch(path.name)
+    index = int(match.group(1)) if match else 0
+    return (path.stat().st_mtime_ns, -index)
+
+
+def iter_log_records(log_dir: Path) -> Iterator[dict[str, Any]]:
+    """Generate request and response records of logs in time order"""
+    if not log_dir.is_dir():
+        raise ValueError(f"Log directory '{log_dir}' not found")
+    for path in sorted(log_dir.iterdir(), key=log_age_key):
+        if path.name.endswith(".json"):
+            with open(path) as file:
+                yield json.load(file)
+        elif path.name.endswith((".jsonl", ".jsonl.gz")):
+            opener = gzip.open if path.suffix == ".gz" else open
+            with opener(path, "rt") as file:
+                for line in file:
+                    yield json.loads(line)
+        elif path.suffix == ".xml":
+            import jsoml
+
+            if isinstance(data := jsoml.load(path), dict):
+                yield data
+
+
+class RecordedResponse:
+    def __init__(self, data: dict[str, Any]):
+        self._data = data
+        self.created = data.get("created", 0)
+        self.model = data.get("model")
+        usage = data.get("usage")
+        self.usage = SimpleNamespace(**usage) if usage else None
+        self.choices = [
+            SimpleNamespace(
+                index=c.get("index", i),
+                message=SimpleNamespace(content=c["message"]["content"]),
+            )
+            for i, c in enumerate(data["choices"])
+        ]
+
+    def model_dump(self, **kwargs: Any) -> dict[str, Any]:
+        return self._data
+
+
+class ReplayApi:
+    """
+    API answering queries with responses from logs, indexed by request hash.
+
+    In strict mode, queries not found in the logs raise `ReplayMiss`.
+    Otherwise they are sent to the live API.
+    """
+
+    log_dir = Path()
+    strict = False
+
+    def __init__(self, api_key: str | None, http: HttpSettings | None = None):
+        self._api_key = api_key
+        self._http = http
+        self._live: LiveOpenAiApi | None = None
+        self._lock = threading.Lock()
+        self.responses = self.load_responses()
+        self.hits = 0
+        self.misses = 0
+
+    def load_responses(self) -> dict[str, dict[str, Any]]:
+        """Return responses keyed by `replay_key` of their requests"""
+        ret = dict()
+        for record in iter_log_records(self.log_dir):
+            if "request" in record and "response" in record:
+                # later logs replace earlier logs of the same request
+                ret[replay_key(record["request"])] = record["response"]
+        return ret
+
+    def query(self, req: dict[str, Any]) -> Any:
+        found = self.responses.get(replay_key(req))
+        with self._lock:
+            if found is not None:
+                self.hits += 1
+                return RecordedResponse(found)
+            self.misses += 1
+            if self.strict:
+                raise ReplayMiss("Request not found in logs")
+            if self._live is None:
+                self._live = LiveOpenAiApi(self._api_key, self._http)
+        return self._live.query(req)
+
+
+def replay_api_class(log_dir: Path, strict: bool = False) -> type[ReplayApi]:
+    """Return API class replaying logs saved in log_dir"""
+    if not Path(log_dir).is_dir():
+        raise ValueError(f"Log directory '{log_dir}' not found")
+    attrs = dict(log_dir=Path(log_dir), strict=strict)
+    return type("ConfiguredReplayApi", (ReplayApi, ), attrs)
@@ -0,0 +1,256 @@
+"""
+Long-lived server keeping configuration, API clients and caches warm.
+
+Requests are sent by the thin client in `copyaid.client` over a Unix socket.
+"""
+
+from .cli import (
+    COPYAID_TMP_DIR, check_filename_collision, get_config_path, load_config,
+    make_task, make_works, postconfig_argparser
+)
+from .client import check_peer, check_socket_dir, socket_path
+from .core import LOGGER, OfflineApi, WorkFiles
+from .task import Config, Task
+from .util import get_std_path
+
+# Python standard libraries
+import argparse, io, json, logging, os, socket, socketserver, threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, NoReturn, TextIO
+
+
+class ThreadLogCapture(logging.Handler):
+    """Capture log messages emitted by the current thread"""
+
+    def __init__(self, buf: io.StringIO):
+        super().__init__()
+        self.buf = buf
+        self.thread_id = threading.get_ident()
+        self.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if record.thread == self.thread_id:
+            self.buf.write(self.format(record) + "\n")
+
+
+class ClientArgumentParser(argparse.ArgumentParser):
+    """Argument parser writing help and errors for the client, not to stdout"""
+
+    out: TextIO
+
+    def print_usage(self, file: Any = None) -> None:
+        self.out.write(self.format_usage())
+
+    def print_help(self, file: Any = None) -> None:
+        self.out.write(self.format_help())
+
+    def exit(self, status: int = 0, message: str | None = None) -> NoReturn:
+        if message:
+            self.out.write(message)
+        raise SystemExit(status)
+
+
+class CopyaidServer:
+    def __init__(self) -> None:
+        self._configs: dict[Path, tuple[int, Config, str]] = dict()
+        self._tasks: dict[tuple[Path, int, str, bool, bool], Task] = dict()
+        self._num_users: dict[Task, int] = dict()
+        self._lock = threading.Lock()
+
+    def _get_config(self, config_path: Path) -> tuple[int, Config, str]:
+        mtime = config_path.stat().st_mtime_ns if config_path.exists() else 0
+        with self._lock:
+            found = self._configs.get(config_path)
+            if found is None or found[0] != mtime:
+                found = (mtime, *load_config(config_path))
+                self._configs[config_path] = found
+            return found
+
+    @contextmanager
+    def _use_task(
+        self, config_path: Path, mtime: int, config: Config, args: argparse.Namespace
+    ) -> Iterator[Task]:
+        """Use task kept between requests, closing tasks of changed configs"""
+        key = (config_path, mtime, args.task, args.no_cache, args.incremental)
+        unused = list()
+        with self._lock:
+            if (task := self._tasks.get(key)) is None:
+                task = self._tasks[key] = make_task(config, args, map_files=False)
+                for k in [k for k in self._tasks if k[0] == config_path]:
+                    if k[1] != mtime:
+                        unused.append(self._tasks.pop(k))
+                # tasks still in use are closed when their last request is done
+                unused = [t for t in unused if not self._num_users.get(t)]
+            self._num_users[task] = self._num_users.get(task, 0) + 1
+        for t in unused:
+            t.close()
+        try:
+            yield task
+        finally:
+            with self._lock:
+                self._num_users[task] -= 1
+                if done := not self._num_users[task]:
+                    del self._num_users[task]
+                done = done and task not in self._tasks.values()
+            if done:
+                task.close()
+
+    def close(self) -> None:
+        with self._lock:
+            tasks = list(self._tasks.values())
+            self._tasks.clear()
+        for task in tasks:
+            task.close()
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        out = io.StringIO()
+        capture = ThreadLogCapture(out)
+        LOGGER.addHandler(capture)
+        ret: dict[str, Any] = dict(exit_code=2, works=[])
+        try:
+            ret["exit_code"] = self._handle(request, out, ret)
+        except SystemExit as ex:
+            ret["exit_code"] = ex.code if isinstance(ex.code, int) else 2
+        except Exception as ex:
+            out.write(f"ERROR: {ex!r}\n")
+        finally:
+            LOGGER.removeHandler(capture)
+        ret["output"] = out.getvalue()
+        return ret
+
+    def _handle(
+        self, request: dict[str, Any], out: io.StringIO, ret: dict[str, Any]
+    ) -> int:
+        cwd = Path(request["cwd"])
+        cmd_line_args = request["args"]
+        config_path = get_config_path(cmd_line_args, cwd)
+        if not config_path:
+            return 2
+        (mtime, config, help_text) = self._get_config(config_path)
+        # stats of tasks kept between requests are not per run, so are not offered
+        parser = postconfig_argparser(
+            config.task_names, help_text, ClientArgumentParser, stats=False
+        )
+        assert isinstance(parser, ClientArgumentParser)
+        parser.out = out
+        args = parser.parse_args(cmd_line_args)
+        dest = cwd / args.dest if args.dest else Path(get_std_path(*COPYAID_TMP_DIR))
+        sources = [cwd / src for src in args.source]
+        exit_code = check_filename_collision(sources)
+        if exit_code != 0:
+            return exit_code
+        (works_iter, missing) = make_works(sources, dest, config.source_extensions)
+        works = list(works_iter)
+        if args.estimate:
+            return self._estimate(config, args, works, missing, out)
+        with self._use_task(config_path, mtime, config, args) as task:
+            if task.can_request:
+                for work in works:
+                    out.write(f"Saving revisions to {work.dest_glob}\n")
+                    out.write(f" for source {work.src}\n")
+                try:
+                    with ThreadPoolExecutor(max(1, args.jobs)) as pool:
+                        list(pool.map(task.request, works))
+                finally:
+                    task.api.clear_dedup()
+        # react commands are taken from the client's own config, never the server
+        ret["task"] = args.task
+        ret["works"] = [
+            dict(src=str(w.src), revisions=[str(p) for p in w.revisions()])
+            for w in works
+        ]
+        if missing:
+            LOGGER.error(f"File not found: '{missing}'")
+            return 2
+        return 0
+
+
+    def _estimate(
+        self,
+        config: Config,
+        args: argparse.Namespace,
+        works: list[WorkFiles],
+        missing: Path | None,
+        out: io.StringIO,
+    ) -> int:
+        from .estimate import estimate_run
+
+        task = make_task(config, args, OfflineApi(), map_files=False)
+        try:
+            if not task.can_request:
+                LOGGER.error(f"Task '{args.task}' does not request revisions.")
+                return 2
+            out.write(estimate_run(config, task, works, args.jobs))
+        finally:
+            task.close()
+        if missing:
+            LOGGER.error(f"File not found: '{missing}'")
+            return 2
+        return 0
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: "UnixServer"
+
+    def handle(self) -> None:
+        try:
+            check_peer(self.request)
+        except PermissionError as ex:
+            LOGGER.warning(f"Connection refused: {ex}")
+            return
+        request = json.loads(self.rfile.read())
+        response = self.server.copyaid.handle(request)
+        self.wfile.write(json.dumps(response).encode())
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path):
+        super().__init__(str(path), RequestHandler)
+        self.copyaid = CopyaidServer()
+
+
+def serve(path: Path) -> None:
+    os.makedirs(path.parent, mode=0o700, exist_ok=True)
+    check_socket_dir(path.parent)
+    if path.exists():
+        # remove a stale socket left by a server that is no longer running
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(str(path))
+                raise RuntimeError(f"Server already running at {path}")
+            except ConnectionRefusedError:
+                path.unlink()
+    with UnixServer(path) as server:
+        try:
+            print("copyaid server listening on", path, flush=True)
+            server.serve_forever()
+        finally:
+            path.unlink(missing_ok=True)
+            server.copyaid.close()
+
+
+def serve_main(cmd_line_args: list[str]) -> int:
+    parser = argparse.ArgumentParser(
+        prog="copyaid serve",
+        description="Serve requests from the copyaid-client command.",
+    )
+    parser.add_argument(
+        "--socket",
+        type=Path,
+        default=socket_path(),
+        metavar="<path>",
+        help="Unix socket path (default: %(default)s)",
+    )
+    args = parser.parse_args(cmd_line_args)
+    try:
+        serve(args.socket)
+    except PermissionError as ex:
+        LOGGER.error(str(ex))
+        return 2
+    except KeyboardInterrupt:
+        pass
+    return 0
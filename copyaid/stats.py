@@ -0,0 +1,122 @@
+# Python Standard Library
+import io, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+SOURCE_COLUMNS = (
+    ("requests", "requests"),
+    ("request_seconds", "api s"),
+    ("prompt_tokens", "prompt tok"),
+    ("completion_tokens", "compl tok"),
+    ("cache_hits", "cached"),
+    ("dedup_hits", "dedup"),
+    ("parse_seconds", "parse s"),
+    ("diffadapt_seconds", "diff cpu s"),
+    ("react_seconds", "react s"),
+)
+PROMPT_COLUMNS = SOURCE_COLUMNS[:6]
+
+
+class RunStats:
+    """
+    Timings, token usage and cache hits of a run, totalled by source and prompt.
+    """
+
+    def __init__(self) -> None:
+        self._sources: dict[str, Counter[str]] = dict()
+        self._prompts: dict[str, Counter[str]] = dict()
+        self._lock = threading.Lock()
+
+    def add(self, source: str, prompt: str | None = None, **amounts: float) -> None:
+        with self._lock:
+            self._sources.setdefault(source, Counter()).update(amounts)
+            if prompt is not None:
+                self._prompts.setdefault(prompt, Counter()).update(amounts)
+
+    def add_usage(self, source: str, prompt: str, usage: Any) -> None:
+        """Add token counts from the usage field of an API response"""
+        if usage is not None:
+            self.add(
+                source,
+                prompt,
+                prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            )
+
+    @contextmanager
+    def timer(self, source: str, key: str, prompt: str | None = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(source, prompt, **{key: time.perf_counter() - start})
+
+    def timed_iter(self, source: str, key: str, items: Iterable[T]) -> Iterator[T]:
+        """Generate items adding up time taken to produce them"""
+        it = iter(items)
+        seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                yield item
+        finally:
+            self.add(source, None, **{key: seconds})
+
+    def total(self) -> Counter[str]:
+        with self._lock:
+            return sum(self._sources.values(), Counter())
+
+    def as_dict(self) -> dict[str, Any]:
+        total = self.total()
+        with self._lock:
+            return dict(
+                sources={k: dict(v) for k, v in self._sources.items()},
+                prompts={k: dict(v) for k, v in self._prompts.items()},
+                total=dict(total),
+            )
+
+    def table(self) -> str:
+        buf = io.StringIO()
+        with self._lock:
+            sources = dict(self._sources)
+            prompts = dict(self._prompts)
+        write_table(buf, "source", SOURCE_COLUMNS, sources, self.total())
+        if prompts:
+            buf.write("\n")
+            write_table(buf, "prompt", PROMPT_COLUMNS, prompts, None)
+        return buf.getvalue()
+
+
+def format_amount(value: float) -> str:
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def write_table(
+    buf: io.StringIO,
+    label: str,
+    columns: Iterable[tuple[str, str]],
+    rows: dict[str, Counter[str]],
+    total: Counter[str] | None,
+) -> None:
+    columns = list(columns)
+    lines = [[label] + [title for _, title in columns]]
+    # slowest first, so the documents and prompts that dominate are at the top
+    order = sorted(rows, key=lambda k: -rows[k]["request_seconds"])
+    for name in order:
+        lines.append([name] + [format_amount(rows[name][key]) for key, _ in columns])
+    if total is not None:
+        lines.append(["total"] + [format_amount(total[key]) for key, _ in columns])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(lines[0]))]
+    for line in lines:
+        cells = [line[0].ljust(widths[0])]
+        cells += [cell.rjust(w) for cell, w in zip(line[1:], widths[1:])]
+        buf.write("  ".join(cells).rstrip() + "\n")
@@ -1,14 +1,19 @@
 import tomli
-from .util import copy_package_dir, read_file_text, resolve_path
+from .cache import ResponseCache
+from .throttle import RateLimiter
+from .util import (
+    copy_package_dir, react_as_commands, read_file_text, read_package_bytes,
+    resolve_path, run_react
+)
 from .core import (
-    ApiProxy, CopybreakSyntax, CopyEditor, SimpleParser, SourceParserProtocol,
-    TrivialParser, WorkFiles, warning
+    ApiProxy, AsyncApiProxy, CopybreakSyntax, CopyEditor, HttpSettings, SimpleParser,
+    SourceParserProtocol, TrivialParser, WorkFiles, warning
 )
 
 # Python Standard Library
-import io, subprocess
+import io
 from pathlib import Path
-from typing import Any, Iterable, Optional
+from typing import Any, Iterable, Iterator, Optional
 
 
 class Task:
@@ -16,26 +21,35 @@ class Task:
         self._editor = ed
         self._react = react_cmds
 
+    @property
+    def api(self) -> ApiProxy:
+        return self._editor.api
+
     @property
     def can_request(self) -> bool:
         return bool(self._editor) and self._editor.has_instructions
 
+    def close(self) -> None:
+        self._editor.close()
+
     def request(self, work: WorkFiles) -> None:
         assert self.can_request
         self._editor.revise(work)
 
+    def iter_requests(self, work: WorkFiles) -> Iterator[tuple[str, dict[str, Any]]]:
+        assert self.can_request
+        return self._editor.iter_requests(work)
+
+    @property
+    def react_commands(self) -> list[str]:
+        return self._react
+
     def react(self, work: WorkFiles) -> int:
-        ret = 0
-        if self._react:
-            found_revs = [str(p) for p in work.revisions()]
-            if found_revs:
-                args = [str(work.src)] + found_revs
-                for cmd in self._react:
-                    proc = subprocess.run([cmd] + args, shell=True)
-                    ret = proc.returncode
-                    if ret:
-                        break
-        return ret
+        if not self._react:
+            return 0
+        with self.api.stats.timer(str(work.src), "react_seconds"):
+            revisions = [str(p) for p in work.revisions()]
+            return run_react(self._react, str(work.src), revisions)
 
 
 class PackageConfig:
@@ -46,12 +60,14 @@ class PackageConfig:
     CONFIG_FILENAME = "copyaid.toml"
 
     def __init__(self, local_dir: Path):
+        # request settings files are read from the local copy
         copy_package_dir("config", local_dir)
-        config_file = local_dir / PackageConfig.CONFIG_FILENAME
-        with open(config_file, "rb") as file:
-            data = tomli.load(file)
+        data = tomli.loads(
+            read_package_bytes("config/" + PackageConfig.CONFIG_FILENAME).decode()
+        )
         self._formats = data.get("formats", {})
         self._commands = data.get("commands", {})
+        self.prices = data.get("prices", {})
         self._tasks: dict[str, Any] = dict()
         self._add_task_data(local_dir, data.get("tasks", {}))
 
@@ -60,31 +76,24 @@ class PackageConfig:
             self._tasks[key] = dict(
                 request=resolve_path(config_dir, task.get("request")),
                 react=task.get("react"),
+                stream=task.get("stream", False),
+                timeout=task.get("timeout"),
             )
 
-    def _get_parsers(self) -> list[SourceParserProtocol]:
+    def _get_parsers(self, map_files: bool = True) -> list[SourceParserProtocol]:
         ret = list()
         for fname, f in self._formats.items():
             if "copybreak" not in f:
                 raise SyntaxError(f"Format '{fname}' table missing 'copybreak' key")
-            ret.append(SimpleParser.from_POD(f))
+            parser = SimpleParser.from_POD(f)
+            parser.map_files = map_files
+            ret.append(parser)
         if not ret:
             warning("No file formats specified in config file.")
         return ret + [TrivialParser()]
 
     def _react_as_commands(self, react: Any) -> list[str]:
-        ret = list()
-        if react is None:
-            react = []
-        elif isinstance(react, str):
-            react = [react]
-        for r in react:
-            cmd = self._commands.get(r)
-            if cmd is None:
-                msg = f"Command '{r}' not found in configuration"
-                raise SyntaxError(msg)
-            ret.append(cmd)
-        return ret
+        return react_as_commands(react, self._commands)
 
 
 class Config(PackageConfig):
@@ -100,30 +109,78 @@ class Config(PackageConfig):
             data = {}
         self._formats.update(data.get("formats", {}))
         self._commands.update(data.get("commands", {}))
+        self.prices.update(data.get("prices", {}))
         self._add_task_data(config_file.parent, data.get("tasks", {}))
         key_path = data.get("openai_api_key_file")
         self.api_key = read_file_text(resolve_path(config_file.parent, key_path))
         self.log_format = data.get("log_format")
+        self.log_max_bytes = int(data.get("log_max_mb", 64) * 2**20)
+        self.max_concurrent_requests = int(data.get("max_concurrent_requests", 1))
+        self.cache_max_bytes = int(data.get("cache_size_mb", 64) * 2**20)
+        self.rate_limit = data.get("rate_limit", {})
+        self.max_chunk_tokens = data.get("max_chunk_tokens", 4000) or None
+        self.max_diff_processes = int(data.get("max_diff_processes", 1))
+        self.http = data.get("http", {})
+        self.estimate_tokens_per_second = data.get("estimate_tokens_per_second", 30)
+        self.estimate_request_seconds = data.get("estimate_request_seconds", 1.0)
 
     @property
     def task_names(self) -> Iterable[str]:
         return self._tasks.keys()
 
-    def get_task(self, task_name: str, log_path: Path) -> Task:
+    @property
+    def source_extensions(self) -> set[str]:
+        """File extensions of configured formats, used to find sources in directories"""
+        return {ext for f in self._formats.values() for ext in f.get("extensions", [])}
+
+    def react_commands(self, task_name: str) -> list[str]:
+        task = self._tasks.get(task_name)
+        if task is None:
+            raise ValueError(f"Invalid task name {task_name}.")
+        return self._react_as_commands(task.get("react"))
+
+    def get_task(
+        self,
+        task_name: str,
+        log_path: Path,
+        cache: ResponseCache | None = None,
+        incremental: bool = False,
+        api_client: Any = None,
+        map_files: bool = True,
+    ) -> Task:
         task = self._tasks.get(task_name)
         if task is None:
             raise ValueError(f"Invalid task name {task_name}.")
         if "clean" in task:
             warning("Configuration setting 'clean' has been deprecated.")
-        api = ApiProxy(self.api_key, log_path, self.log_format)
+        http = None
+        if self.http or task.get("timeout"):
+            http = HttpSettings.from_POD(self.http)
+            http.timeout = task.get("timeout") or http.timeout
+        proxy_class = AsyncApiProxy if http and http.use_async else ApiProxy
+        api = proxy_class(self.api_key, log_path, self.log_format, api_client, http)
+        if api.log_writer:
+            api.log_writer.max_bytes = self.log_max_bytes
+        api.cache = cache
+        # only the live API streams responses
+        api.stream = bool(task.get("stream")) and api_client is None
+        rpm = self.rate_limit.get("requests_per_minute")
+        tpm = self.rate_limit.get("tokens_per_minute")
+        if rpm or tpm:
+            api.throttle.limiter = RateLimiter(rpm, tpm)
+        if "max_retries" in self.rate_limit:
+            api.throttle.max_retries = int(self.rate_limit["max_retries"])
         ed = CopyEditor(api)
-        ed.parsers = self._get_parsers()
+        ed.parsers = self._get_parsers(map_files)
+        ed.max_concurrency = self.max_concurrent_requests
+        ed.incremental = incremental
+        ed.max_chunk_tokens = self.max_chunk_tokens
+        ed.max_diff_processes = self.max_diff_processes
         ed.add_off_instruction("off")
         if path := task.get("request"):
             ed.set_instruction("on", path)
             ed.set_init_instruction("on")
-        cmds = self._react_as_commands(task.get("react"))
-        return Task(ed, cmds)
+        return Task(ed, self.react_commands(task_name))
 
     def help(self) -> str:
         buf = io.StringIO()
@@ -0,0 +1,158 @@
+from .tokens import estimate_text_tokens
+
+# Python Standard Library
+import inspect, random, threading, time
+from typing import Any, Callable
+
+RETRYABLE_ERROR_NAMES = ("APIConnectionError", "APITimeoutError")
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.stamp = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take amount from bucket and return seconds to wait until it is available"""
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+
+class RateLimiter:
+    def __init__(
+        self, requests_per_minute: float | None, tokens_per_minute: float | None
+    ):
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def reserve(self, num_tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self._requests:
+                wait = max(wait, self._requests.reserve(1, now))
+            if self._tokens:
+                wait = max(wait, self._tokens.reserve(num_tokens, now))
+            return wait
+
+
+def estimate_tokens(request: dict[str, Any]) -> int:
+    """Estimate tokens counted against rate limits using max_tokens of request"""
+    model = request.get("model")
+    messages = request.get("messages", [])
+    prompt_tokens = sum(estimate_text_tokens(m["content"], model) for m in messages)
+    return int(prompt_tokens) + int(request.get("max_tokens", 0) * request.get("n", 1))
+
+
+def is_retryable(ex: Exception) -> bool:
+    status = getattr(ex, "status_code", None)
+    if status is not None:
+        return bool(status == 429 or status >= 500)
+    # check names to avoid a slow import of the openai module
+    return any(c.__name__ in RETRYABLE_ERROR_NAMES for c in type(ex).__mro__)
+
+
+def retry_after(ex: Exception) -> float | None:
+    headers = getattr(getattr(ex, "response", None), "headers", None) or {}
+    try:
+        if value := headers.get("retry-after-ms"):
+            return float(value) / 1000
+        if value := headers.get("retry-after"):
+            return float(value)
+    except ValueError:
+        pass
+    return None
+
+
+class ThrottledApi:
+    """
+    Scheduling layer that rate limits and retries queries to an API.
+    """
+
+    def __init__(self, api: Any, limiter: RateLimiter | None = None):
+        self._api = api
+        self.limiter = limiter
+        self.max_retries = 5
+        self.base_delay = 1.0
+        self.max_delay = 60.0
+        self.throttled_seconds = 0.0
+        self.num_retries = 0
+        self._lock = threading.Lock()
+
+    def _count_sleep(self, seconds: float) -> float:
+        if seconds > 0:
+            with self._lock:
+                self.throttled_seconds += seconds
+        return seconds
+
+    def _sleep(self, seconds: float) -> None:
+        if self._count_sleep(seconds) > 0:
+            time.sleep(seconds)
+
+    def _retry_delay(self, ex: Exception, attempt: int) -> float | None:
+        """Return delay before retrying, or None if query should not be retried"""
+        if attempt >= self.max_retries or not is_retryable(ex):
+            return None
+        delay = retry_after(ex)
+        if delay is None:
+            delay = min(self.base_delay * 2**attempt, self.max_delay)
+            delay = random.uniform(delay / 2, delay)
+        with self._lock:
+            self.num_retries += 1
+        return delay
+
+    def query(self, req: Any, read: Callable[[Any], Any] | None = None) -> Any:
+        """Query API, retrying errors raised by the query or by reading its response"""
+        attempt = 0
+        num_tokens = estimate_tokens(req) if self.limiter else 0
+        while True:
+            if self.limiter:
+                self._sleep(self.limiter.reserve(num_tokens))
+            try:
+                ret = self._api.query(req)
+                return read(ret) if read else ret
+            except Exception as ex:
+                delay = self._retry_delay(ex, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                self._sleep(delay)
+
+
+class AsyncThrottledApi(ThrottledApi):
+    """
+    Throttled API for use in an event loop, waiting without blocking the loop.
+
+    The API query method can either return a response or an awaitable response.
+    """
+
+    async def _async_sleep(self, seconds: float) -> None:
+        import asyncio  # delay a slow import
+
+        if self._count_sleep(seconds) > 0:
+            await asyncio.sleep(seconds)
+
+    async def query(self, req: Any, read: Callable[[Any], Any] | None = None) -> Any:
+        attempt = 0
+        num_tokens = estimate_tokens(req) if self.limiter else 0
+        while True:
+            if self.limiter:
+                await self._async_sleep(self.limiter.reserve(num_tokens))
+            try:
+                ret = self._api.query(req)
+                ret = (await ret) if inspect.isawaitable(ret) else ret
+                if read:
+                    ret = read(ret)
+                    ret = (await ret) if inspect.isawaitable(ret) else ret
+                return ret
+            except Exception as ex:
+                delay = self._retry_delay(ex, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await self._async_sleep(delay)
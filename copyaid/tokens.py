@@ -0,0 +1,53 @@
+"""
+Token counting with the optional tiktoken package.
+
+Without tiktoken installed, or when its encodings can not be loaded (tiktoken
+downloads them on first use), token counts are estimated from character counts.
+"""
+
+# Python Standard Library
+import logging
+from functools import lru_cache
+from typing import Any
+
+FALLBACK_ENCODING = "o200k_base"
+MAX_CACHED_COUNTS = 4096
+
+_load_failed = False
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str | None) -> Any:
+    """Return tiktoken encoding for model, or None if it is not available"""
+    global _load_failed
+    try:
+        import tiktoken  # delay a slow import
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model or "")
+        except KeyError:
+            return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as ex:
+        if not _load_failed:
+            _load_failed = True
+            msg = "Estimating token counts, tiktoken encoding not loaded: {!r}"
+            logging.getLogger("copyaid").warning(msg.format(ex))
+        return None
+
+
+# the same segment text is counted to set max_tokens, split chunks and throttle
+@lru_cache(maxsize=MAX_CACHED_COUNTS)
+def count_tokens(text: str, model: str | None = None) -> int | None:
+    """Return exact token count of text, or None if tiktoken is not available"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        return None
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def estimate_text_tokens(text: str, model: str | None = None) -> float:
+    """Return exact token count if possible, otherwise an estimate"""
+    ret = count_tokens(text, model)
+    return len(text) / 4 if ret is None else ret
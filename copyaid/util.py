@@ -1,12 +1,16 @@
 # Python standard libraries
-import os, shutil
+import hashlib, os, shutil, subprocess
 from importlib import resources
 from pathlib import Path
 from typing import Any
 
+COPYAID_CONFIG_FILENAME = "copyaid.toml"
+COPYAID_CONFIG_FILE = ("XDG_CONFIG_HOME", "copyaid/" + COPYAID_CONFIG_FILENAME)
+
 STD_BASE_DIRS = dict(
     TMPDIR="/tmp",
     XDG_CONFIG_HOME="~/.config",
+    XDG_CACHE_HOME="~/.cache",
     XDG_STATE_HOME="~/.local/state",
 )
 
@@ -18,12 +22,40 @@ def get_std_path(env_var_name: str, subpath: str) -> Path:
     return Path(base_dir).expanduser() / subpath
 
 
+def config_file_path(config: Path | None) -> Path:
+    """Return path of config file given by option, or the default config file"""
+    ret = config or get_std_path(*COPYAID_CONFIG_FILE)
+    if ret.is_dir():
+        ret = ret / COPYAID_CONFIG_FILENAME
+    return ret
+
+
+PACKAGE_STAMP_FILENAME = ".copyaid-stamp"
+
+
+def read_package_bytes(package_path: str) -> bytes:
+    return resources.files(__package__).joinpath(package_path).read_bytes()
+
+
 def copy_package_dir(package_path: str, dest_dir: Path) -> None:
-    os.makedirs(dest_dir, exist_ok=True)
+    """Copy package files unless an up-to-date copy is already in dest_dir"""
     quasidir = resources.files(__package__).joinpath(package_path)
-    for quasipath in quasidir.iterdir():
+    quasipaths = sorted(quasidir.iterdir(), key=lambda p: p.name)
+    stamp = hashlib.sha256()
+    for quasipath in quasipaths:
+        stamp.update(quasipath.name.encode() + b"\0" + quasipath.read_bytes())
+    stamp_path = dest_dir / PACKAGE_STAMP_FILENAME
+    try:
+        if stamp_path.read_text() == stamp.hexdigest():
+            if all((dest_dir / p.name).exists() for p in quasipaths):
+                return
+    except OSError:
+        pass
+    os.makedirs(dest_dir, exist_ok=True)
+    for quasipath in quasipaths:
         with resources.as_file(quasipath) as filepath:
             shutil.copy(filepath, dest_dir)
+    stamp_path.write_text(stamp.hexdigest())
 
 
 def resolve_path(ref_dir: Path, path: Any) -> Path | None:
@@ -41,3 +73,30 @@ def read_file_text(file_path: Path | None) -> str | None:
         with open(file_path, 'r') as file:
             ret = file.read().strip()
     return ret
+
+
+def react_as_commands(react: Any, commands: dict[str, str]) -> list[str]:
+    ret = list()
+    if react is None:
+        react = []
+    elif isinstance(react, str):
+        react = [react]
+    for r in react:
+        cmd = commands.get(r)
+        if cmd is None:
+            msg = f"Command '{r}' not found in configuration"
+            raise SyntaxError(msg)
+        ret.append(cmd)
+    return ret
+
+
+def run_react(cmds: list[str], src: str, revisions: list[str]) -> int:
+    ret = 0
+    if revisions:
+        args = [src] + revisions
+        for cmd in cmds:
+            proc = subprocess.run([cmd] + args, shell=True)
+            ret = proc.returncode
+            if ret:
+                break
+    return ret
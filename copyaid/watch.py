@@ -0,0 +1,110 @@
+"""
+Request revisions again whenever watched source files are saved.
+
+Changes are detected by polling file status. The task stays loaded between
+saves and runs in incremental mode so only changed segments are requested.
+"""
+
+from .cli import make_task, make_works, parse_config_args, postconfig_argparser
+from .core import WorkFiles, error
+from .task import Task
+
+# Python standard libraries
+import argparse, os, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+FileStamp = Optional[tuple[int, int, int]]
+
+
+def file_stamp(path: Path) -> FileStamp:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    # editors often save by renaming a new file over the old one
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class Watcher:
+    def __init__(self, task: Task, works: Iterable[WorkFiles], jobs: int = 1):
+        self.task = task
+        self.works = list(works)
+        self.jobs = jobs
+        self._stamps: dict[Path, FileStamp] = {w.src: None for w in self.works}
+
+    def changed(self) -> list[WorkFiles]:
+        ret = list()
+        for work in self.works:
+            stamp = file_stamp(work.src)
+            if stamp != self._stamps[work.src]:
+                self._stamps[work.src] = stamp
+                if stamp is not None:
+                    ret.append(work)
+        return ret
+
+    def _request(self, work: WorkFiles) -> None:
+        try:
+            self.task.request(work)
+            print("Saved revisions to", work.dest_glob, flush=True)
+        except Exception as ex:
+            error(f"Revising '{work.src}' failed: {ex!r}")
+
+    def poll(self) -> int:
+        """Request revisions for changed sources and return how many changed"""
+        works = self.changed()
+        if works:
+            with ThreadPoolExecutor(self.jobs) as pool:
+                list(pool.map(self._request, works))
+            self.task.api.clear_dedup()
+        return len(works)
+
+    def run(self, interval: float, max_polls: int | None = None) -> None:
+        num_polls = 0
+        while max_polls is None or num_polls < max_polls:
+            if num_polls:
+                time.sleep(interval)
+            self.poll()
+            num_polls += 1
+
+
+def watch_argparser(
+    task_names: Iterable[str], help_text: str
+) -> argparse.ArgumentParser:
+    parser = postconfig_argparser(task_names, help_text, estimate=False, stats=False)
+    parser.prog = "copyaid watch"
+    parser.description = "Request revisions again whenever a source is saved."
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        metavar="<seconds>",
+        help="Time between checks for changes (default: %(default)s)"
+    )
+    return parser
+
+
+def watch_main(cmd_line_args: list[str]) -> int:
+    if not (parsed := parse_config_args(cmd_line_args, watch_argparser)):
+        return 2
+    (config, args) = parsed
+    args.incremental = True
+    task = make_task(config, args, map_files=False)
+    if not task.can_request:
+        error(f"Task '{args.task}' does not request revisions.")
+        return 2
+    (works_iter, missing) = make_works(args.source, args.dest, config.source_extensions)
+    works = list(works_iter)
+    if missing:
+        error(f"File not found: '{missing}'")
+        return 2
+    for work in works:
+        print("Watching", work.src, "saving revisions to", work.dest_glob)
+    try:
+        Watcher(task, works, args.jobs).run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        task.close()
+    return 0
@@ -0,0 +1,19 @@
+from copyaid.cache import ResponseCache
+
+
+def test_cache_eviction(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=200)
+    for i in range(10):
+        cache.put({"n": i}, [f"choice {i}"])
+    assert cache.get({"n": 0}) is None
+    assert cache.get({"n": 9}) == ["choice 9"]
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert sum(p.stat().st_size for p in tmp_path.iterdir()) <= 200
+
+
+def test_cache_replace_size(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=2**20)
+    for i in range(10):
+        cache.put({"n": 0}, [f"choice {i}"])
+        cache.put({"n": 1}, ["other"])
+    assert cache._size == sum(p.stat().st_size for p in tmp_path.iterdir())
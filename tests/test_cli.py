@@ -2,12 +2,14 @@ import pytest
 
 import copyaid.cli
 
-import os
+import asyncio, os, threading, time
+from pathlib import Path
 from types import SimpleNamespace
 
 SOURCE_TEXT = "Jupiter big.\nJupiter a planet.\nJupiter gas.\n"
 MOCK_COMPLETION = "Jupiter is a big planet made of gas."
 EXPECTED_TEXT = "Jupiter is\na big planet made of\ngas.\n"
+PROOFREAD_SETTINGS = Path("copyaid/config/proofread.toml").resolve()
 
 class MockApi:
     def __init__(self, api_key):
@@ -28,6 +30,13 @@ class MockApi:
 copyaid.core.ApiProxy.ApiClass = MockApi
 
 
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    ret = tmp_path / "cache"
+    monkeypatch.setenv("XDG_CACHE_HOME", str(ret))
+    return ret
+
+
 def get_revision(src_path, src_text, task="proof"):
     open(src_path, "w").write(src_text)
     retcode = copyaid.cli.main([
@@ -80,3 +89,597 @@ def test_copybreak_off_foobar(tmp_path):
     src_text = SOURCE_TEXT + copybreak + SOURCE_TEXT
     got = get_revision(tmp_path / "source.foobar", src_text, "fooit")
     assert got == EXPECTED_TEXT + copybreak + SOURCE_TEXT
+
+class EchoUpperApi(MockApi):
+    def query(self, req):
+        ret = super().query(req)
+        content = req["messages"][1]["content"]
+        ret.choices[0].message.content = content.upper()
+        return ret
+
+def run_task_with_config(tmp_path, src_name, src_text, config_text=""):
+    config_path = tmp_path / "copyaid.toml"
+    config_path.write_text(
+        config_text +
+        "[tasks.custom]\n"
+        f"request = '{PROOFREAD_SETTINGS}'\n"
+    )
+    src_path = tmp_path / src_name
+    src_path.write_text(src_text)
+    retcode = copyaid.cli.main([
+        "custom",
+        str(src_path),
+        "--dest", str(tmp_path),
+        "--config", str(config_path),
+    ])
+    assert retcode == 0
+    return (tmp_path / "R1" / src_name).read_text()
+
+class InFlightApi(EchoUpperApi):
+    lock = threading.Lock()
+    num_in_flight = 0
+    max_in_flight = 0
+
+    def query(self, req):
+        with InFlightApi.lock:
+            InFlightApi.num_in_flight += 1
+            InFlightApi.max_in_flight = max(
+                InFlightApi.max_in_flight, InFlightApi.num_in_flight
+            )
+        time.sleep(0.05)
+        with InFlightApi.lock:
+            InFlightApi.num_in_flight -= 1
+        return super().query(req)
+
+def test_concurrent_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", InFlightApi)
+    InFlightApi.max_in_flight = 0
+    copybreak = "<!-- copybreak -->\n"
+    src_text = copybreak.join(f"Segment {i}.\n" for i in range(10))
+    config = "max_concurrent_requests = 4\n"
+    got = run_task_with_config(tmp_path, "source.md", src_text, config)
+    assert got == copybreak.join(f"SEGMENT {i}.\n" for i in range(10))
+    assert 1 < InFlightApi.max_in_flight <= 4
+
+def test_chunking(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", EchoUpperApi)
+    src_text = "".join(f"Paragraph {i} is here.\n\n" for i in range(5))
+    config = "max_chunk_tokens = 10\n"
+    got = run_task_with_config(tmp_path, "source.tex", src_text, config)
+    assert got == src_text.upper()
+    assert len(copyaid.core.split_chunks(src_text, 10)) == 5
+
+
+def test_jobs(tmp_path):
+    sources = [tmp_path / f"source{i}.txt" for i in range(5)]
+    for src in sources:
+        src.write_text(SOURCE_TEXT)
+    retcode = copyaid.cli.main(
+        ["proof", "--jobs", "3"] + [str(s) for s in sources] + [
+        "--dest", str(tmp_path),
+        "--config", "tests/mock_config.toml",
+    ])
+    assert retcode == 0
+    for src in sources:
+        assert (tmp_path / "R1" / src.name).read_text() == EXPECTED_TEXT
+
+
+class CountingApi(MockApi):
+    num_queries = 0
+
+    def query(self, req):
+        CountingApi.num_queries += 1
+        return super().query(req)
+
+def test_cache(tmp_path, cache_home, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", CountingApi)
+    CountingApi.num_queries = 0
+    assert get_revision(tmp_path / "source.txt", SOURCE_TEXT) == EXPECTED_TEXT
+    assert get_revision(tmp_path / "source.txt", SOURCE_TEXT) == EXPECTED_TEXT
+    assert CountingApi.num_queries == 1
+    assert len(list((cache_home / "copyaid/responses").iterdir())) == 1
+
+def test_incremental(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", CountingApi)
+    CountingApi.num_queries = 0
+    copybreak = "<!-- copybreak -->\n"
+    src_path = tmp_path / "source.md"
+    args = [
+        "proof", str(src_path),
+        "--dest", str(tmp_path),
+        "--config", "tests/mock_config.toml",
+        "--no-cache",
+        "--incremental",
+    ]
+    src_path.write_text(SOURCE_TEXT + copybreak + SOURCE_TEXT)
+    assert copyaid.cli.main(args) == 0
+    # identical segments are only requested once
+    assert CountingApi.num_queries == 1
+    src_path.write_text(SOURCE_TEXT + copybreak + "Jupiter big.\n")
+    assert copyaid.cli.main(args) == 0
+    assert CountingApi.num_queries == 2
+    got = (tmp_path / "R1" / "source.md").read_text()
+    assert got.startswith(EXPECTED_TEXT + copybreak)
+
+class RateLimitError(Exception):
+    status_code = 429
+    response = SimpleNamespace(headers={"retry-after": "0"})
+
+class FlakyApi(MockApi):
+    num_failures = 0
+
+    def query(self, req):
+        if FlakyApi.num_failures < 2:
+            FlakyApi.num_failures += 1
+            raise RateLimitError()
+        return super().query(req)
+
+def test_retry(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", FlakyApi)
+    FlakyApi.num_failures = 0
+    assert get_revision(tmp_path / "source.txt", SOURCE_TEXT) == EXPECTED_TEXT
+    assert FlakyApi.num_failures == 2
+
+def test_diff_processes(tmp_path):
+    copybreak = "<!-- copybreak -->\n"
+    src_text = SOURCE_TEXT + copybreak + SOURCE_TEXT + copybreak + SOURCE_TEXT
+    config = "max_diff_processes = 2\n"
+    got = run_task_with_config(tmp_path, "source.md", src_text, config)
+    assert got == EXPECTED_TEXT + copybreak + EXPECTED_TEXT + copybreak + EXPECTED_TEXT
+
+class StreamingApi(MockApi):
+    num_failures = 0
+
+    def query(self, req):
+        assert req["stream"]
+        for i, word in enumerate(MOCK_COMPLETION.split(" ")):
+            if i == 3 and StreamingApi.num_failures < 1:
+                StreamingApi.num_failures += 1
+                raise RateLimitError()
+            delta = SimpleNamespace(content=(" " if i else "") + word)
+            choice = SimpleNamespace(index=0, delta=delta)
+            yield SimpleNamespace(created=1674259148, choices=[choice])
+
+def test_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", StreamingApi)
+    StreamingApi.num_failures = 0
+    config_path = tmp_path / "copyaid.toml"
+    config_path.write_text(
+        f"[tasks.custom]\nrequest = '{PROOFREAD_SETTINGS}'\nstream = true\n"
+    )
+    src_path = tmp_path / "source.txt"
+    src_path.write_text(SOURCE_TEXT)
+    args = ["custom", str(src_path), "--dest", str(tmp_path)]
+    assert copyaid.cli.main(args + ["--config", str(config_path)]) == 0
+    assert (tmp_path / "R1" / "source.txt").read_text() == EXPECTED_TEXT
+    # an error while reading the stream is retried
+    assert StreamingApi.num_failures == 1
+
+
+class BlockingApi(EchoUpperApi):
+    release = None
+
+    def query(self, req):
+        if "Segment 1." in req["messages"][1]["content"]:
+            assert BlockingApi.release.wait(30)
+        return super().query(req)
+
+def test_save_while_waiting(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", BlockingApi)
+    BlockingApi.release = threading.Event()
+    copybreak = "<!-- copybreak -->\n"
+    src_text = copybreak.join(f"Segment {i}.\n" for i in range(2))
+    config = "max_concurrent_requests = 2\nmax_diff_processes = 2\n"
+    args = (tmp_path, "source.md", src_text, config)
+    thread = threading.Thread(target=run_task_with_config, args=args)
+    thread.start()
+    try:
+        dest = tmp_path / "R1" / "source.md"
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if dest.exists() and dest.read_text():
+                break
+            time.sleep(0.01)
+        # the first segment is saved while the request for the second is waiting
+        assert dest.read_text() == "SEGMENT 0.\n"
+    finally:
+        BlockingApi.release.set()
+        thread.join()
+    assert dest.read_text() == copybreak.join(["SEGMENT 0.\n", "SEGMENT 1.\n"])
+
+def test_server(tmp_path, monkeypatch, capsys):
+    import copyaid.client, copyaid.server
+
+    sock_path = tmp_path / "server.sock"
+    monkeypatch.setenv("COPYAID_SOCKET", str(sock_path))
+    server = copyaid.server.UnixServer(sock_path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    closed = list()
+    monkeypatch.setattr(copyaid.task.Task, "close", lambda self: closed.append(self))
+    config_path = tmp_path / "copyaid.toml"
+    config_path.write_text(Path("tests/mock_config.toml").read_text())
+    try:
+        src_path = tmp_path / "source.txt"
+        src_path.write_text(SOURCE_TEXT)
+        args = ["proof", str(src_path), "--dest", str(tmp_path)]
+        args += ["--config", str(config_path)]
+        for i in range(2):
+            assert copyaid.client.main(args) == 0
+            assert (tmp_path / "R1" / "source.txt").read_text() == EXPECTED_TEXT
+        assert len(server.copyaid._tasks) == 1
+        (old_task,) = server.copyaid._tasks.values()
+        os.utime(config_path, ns=(0, 0))
+        assert copyaid.client.main(args) == 0
+        assert len(server.copyaid._tasks) == 1
+        assert closed == [old_task]
+        capsys.readouterr()
+        assert copyaid.client.main(args + ["--estimate"]) == 0
+        assert "Requests: 1 " in capsys.readouterr().out
+        assert len(server.copyaid._tasks) == 1
+        assert copyaid.client.main(args + ["--stats"]) == 2
+        assert "unrecognized arguments" in capsys.readouterr().out
+        assert copyaid.client.main(["nosuchtask", str(src_path)]) == 2
+        assert "invalid choice" in capsys.readouterr().out
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_client_react_commands():
+    import copyaid.client
+
+    args = ["fooit", "src.txt", "--config", "tests/mock_config.toml"]
+    (config, _) = copyaid.cli.load_config(Path("tests/mock_config.toml"))
+    for task_name in ["fooit", "proof", "diff"]:
+        expected = config.react_commands(task_name)
+        assert copyaid.client.react_commands(task_name, args) == expected
+
+
+def test_server_socket_dir(tmp_path):
+    import copyaid.client
+
+    sock_dir = tmp_path / "shared"
+    sock_dir.mkdir(mode=0o777)
+    sock_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        copyaid.client.send_request(sock_dir / "server.sock", dict())
+
+
+def test_package_copy_stamp(tmp_path):
+    from copyaid.util import copy_package_dir
+
+    copy_package_dir("config", tmp_path)
+    settings = tmp_path / "proofread.toml"
+    settings.write_text("edited")
+    copy_package_dir("config", tmp_path)
+    assert settings.read_text() == "edited"
+    settings.unlink()
+    copy_package_dir("config", tmp_path)
+    assert settings.read_text() != "edited"
+    (tmp_path / ".copyaid-stamp").write_text("stale")
+    copy_package_dir("config", tmp_path)
+    assert (tmp_path / ".copyaid-stamp").read_text() != "stale"
+
+
+def test_watch(tmp_path, monkeypatch):
+    import copyaid.watch
+
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", CountingApi)
+    CountingApi.num_queries = 0
+    (config, _) = copyaid.cli.load_config(Path("tests/mock_config.toml"))
+    task = config.get_task("proof", tmp_path / "log", incremental=True)
+    src_path = tmp_path / "source.txt"
+    src_path.write_text(SOURCE_TEXT)
+    (works, _) = copyaid.cli.make_works([src_path], tmp_path)
+    watcher = copyaid.watch.Watcher(task, works)
+    assert watcher.poll() == 1
+    assert watcher.poll() == 0
+    assert (tmp_path / "R1" / "source.txt").read_text() == EXPECTED_TEXT
+    src_path.write_text(SOURCE_TEXT + "\n")
+    assert watcher.poll() == 1
+    assert CountingApi.num_queries == 2
+    task.close()
+    args = ["proof", str(src_path), "--config", "tests/mock_config.toml"]
+    with pytest.raises(SystemExit):
+        copyaid.watch.watch_main(args + ["--estimate"])
+
+
+def test_directory_sources(tmp_path):
+    src_dir = tmp_path / "docs"
+    for rel in ["a/source.md", "b/source.md", "b/c/source.tex", "b/skip.txt"]:
+        (src_dir / rel).parent.mkdir(parents=True, exist_ok=True)
+        (src_dir / rel).write_text(SOURCE_TEXT)
+    (src_dir / ".hidden").mkdir()
+    (src_dir / ".hidden/source.md").write_text(SOURCE_TEXT)
+    dest = tmp_path / "dest"
+    retcode = copyaid.cli.main([
+        "proof",
+        str(src_dir),
+        "--dest", str(dest),
+        "--config", "tests/mock_config.toml",
+    ])
+    assert retcode == 0
+    got = sorted(str(p.relative_to(dest)) for p in dest.rglob("source.*"))
+    assert got == [
+        "R1/docs/a/source.md", "R1/docs/b/c/source.tex", "R1/docs/b/source.md"
+    ]
+    assert (dest / "R1/docs/b/c/source.tex").read_text() == EXPECTED_TEXT
+
+
+def test_lazy_parse(tmp_path):
+    from copyaid.core import SimpleParser
+
+    parser = SimpleParser.from_POD({
+        "extensions": [".md"],
+        "copybreak": {"keywords": ["copybreak"], "prefix": "<!--", "suffix": "-->"},
+    })
+    src_path = tmp_path / "source.md"
+    src_path.write_text("a\n<!-- copybreak off -->\nb\n<!-- copybreak on -->\nc\n")
+    parsed = parser.parse(src_path)
+    assert parsed.instructions() == {"on", "off"}
+    assert not isinstance(parsed.segments, list)
+    assert [s.text for s in parsed.segments] == ["a\n", "b\n", "c\n"]
+
+
+def test_copybreak_scan(tmp_path):
+    from copyaid.core import SimpleParser
+
+    parser = SimpleParser.from_POD({"copybreak": {
+        "keywords": ["copybreak"], "prefix": "%%"
+    }})
+    src_path = tmp_path / "source.tex"
+    src_path.write_bytes(
+        b"a %% copybreak\r\n  %% copybreak on\r\nb\r\n%% copybreaks\r\n%%copybreak"
+    )
+    parsed = parser.parse(src_path)
+    assert parsed.instructions() == {"on"}
+    got = [(s.copybreak and s.copybreak.raw_line, s.text) for s in parsed.segments]
+    assert got == [
+        (None, "a %% copybreak\n"),
+        ("  %% copybreak on\n", "b\n%% copybreaks\n"),
+        ("%%copybreak", ""),
+    ]
+
+
+def test_copybreak_scan_fuzz(tmp_path):
+    import random
+    from copyaid.core import SimpleParser
+
+    parser = SimpleParser.from_POD({"copybreak": {
+        "keywords": ["copybreak"], "prefix": "%%", "suffix": "!"
+    }})
+    pieces = ["%%", "copybreak", "on", "x", "!", " ", "\t", "\xa0", "\u2003"]
+    pieces += ["\n", "\r", "\r\n"]
+    rng = random.Random(0)
+    src_path = tmp_path / "source.tex"
+    for i in range(500):
+        src_path.write_text("".join(rng.choices(pieces, k=20)), newline="")
+        # reference is parsing lines of the file read in text mode
+        expected = []
+        (copybreak, lines) = (None, [])
+        with open(src_path, encoding=parser.encoding) as file:
+            for line in file:
+                if found := parser.copybreak.parse(line, quiet=True):
+                    expected.append((copybreak, "".join(lines)))
+                    (copybreak, lines) = (line, [])
+                else:
+                    lines.append(line)
+        expected.append((copybreak, "".join(lines)))
+        segments = parser.parse(src_path).segments
+        got = [(s.copybreak and s.copybreak.raw_line, s.text) for s in segments]
+        assert got == expected
+
+
+def test_parse_once(tmp_path):
+    from copyaid.core import SimpleParser
+
+    parser = SimpleParser.from_POD({"copybreak": {
+        "keywords": ["copybreak"], "prefix": "%%"
+    }})
+    parser.map_files = False
+    src_path = tmp_path / "source.tex"
+    src_path.write_text("One.\n%% copybreak off\nTwo.\n")
+    parsed = parser.parse(src_path)
+    src_path.write_text("One.\n%% copybreak new\nTwo.\n")
+    segments = list(parsed.segments)
+    assert parsed.instructions() == {"off"}
+    assert segments[1].copybreak.instruction == "off"
+
+
+def test_stats(tmp_path, capsys):
+    import json
+
+    src_path = tmp_path / "source.md"
+    src_path.write_text(SOURCE_TEXT + "<!-- copybreak -->\nOther text.\n")
+    stats_path = tmp_path / "stats.json"
+    retcode = copyaid.cli.main([
+        "proof",
+        str(src_path),
+        "--dest", str(tmp_path),
+        "--config", "tests/mock_config.toml",
+        "--stats",
+        "--stats-json", str(stats_path),
+    ])
+    assert retcode == 0
+    assert "total" in capsys.readouterr().out
+    data = json.loads(stats_path.read_text())
+    assert data["sources"][str(src_path)]["requests"] == 2
+    assert data["total"]["requests"] == 2
+    assert data["total"]["parse_seconds"] > 0
+    assert len(data["prompts"]) == 1
+
+
+class DumpableApi(MockApi):
+    def query(self, req):
+        ret = super().query(req)
+        ret.model_dump = lambda **kwargs: dict(created=ret.created)
+        return ret
+
+@pytest.mark.parametrize("log_format", ["jsonl", "jsonl.gz"])
+def test_jsonl_log(tmp_path, monkeypatch, log_format):
+    import gzip, json
+
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", DumpableApi)
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path / "state"))
+    src_text = "<!-- copybreak -->\n".join(f"Segment {i}.\n" for i in range(3))
+    config = f'log_format = "{log_format}"\nlog_max_mb = 0.0001\n'
+    run_task_with_config(tmp_path, "source.md", src_text, config)
+    log_dir = tmp_path / "state/copyaid/log"
+    records = list()
+    for path in sorted(log_dir.iterdir()):
+        with gzip.open(path, "rt") if log_format.endswith(".gz") else open(path) as f:
+            records += [json.loads(line) for line in f]
+    assert len(records) == 3
+    names = {f"source.{i}.20230120T235908Z" for i in range(3)}
+    assert {r["name"] for r in records} == names
+
+
+class RecordingApi(EchoUpperApi):
+    def query(self, req):
+        ret = super().query(req)
+        content = ret.choices[0].message.content
+        ret.model_dump = lambda **kwargs: dict(
+            created=ret.created, choices=[dict(message=dict(content=content))]
+        )
+        return ret
+
+def test_replay(tmp_path, cache_home, monkeypatch):
+    import shutil
+    from copyaid.replay import ReplayMiss, replay_api_class
+
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", RecordingApi)
+    monkeypatch.setenv("XDG_STATE_HOME", str(tmp_path / "state"))
+    src_text = "<!-- copybreak -->\n".join(f"Segment {i}.\n" for i in range(3))
+    config = 'log_format = "jsonl"\n'
+    expected = run_task_with_config(tmp_path, "source.md", src_text, config)
+    shutil.rmtree(cache_home)
+    log_dir = tmp_path / "state/copyaid/log"
+    replay = replay_api_class(log_dir, strict=True)
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", replay)
+    assert run_task_with_config(tmp_path, "source.md", src_text) == expected
+    assert expected == src_text.replace("Segment", "SEGMENT")
+    with pytest.raises(ReplayMiss):
+        run_task_with_config(tmp_path, "source.md", "Not logged.\n")
+
+
+class SlowCountingApi(CountingApi):
+    def query(self, req):
+        time.sleep(0.05)
+        return super().query(req)
+
+def test_dedup(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", SlowCountingApi)
+    CountingApi.num_queries = 0
+    sources = [tmp_path / f"source{i}.txt" for i in range(4)]
+    for src in sources:
+        src.write_text(SOURCE_TEXT)
+    retcode = copyaid.cli.main(
+        ["proof"] + [str(s) for s in sources] + [
+            "--dest", str(tmp_path),
+            "--config", "tests/mock_config.toml",
+            "--no-cache",
+            "--jobs", "4",
+        ]
+    )
+    assert retcode == 0
+    assert CountingApi.num_queries == 1
+    for src in sources:
+        assert (tmp_path / "R1" / src.name).read_text() == EXPECTED_TEXT
+
+
+def test_dedup_per_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", CountingApi)
+    CountingApi.num_queries = 0
+    (config, _) = copyaid.cli.load_config(Path("tests/mock_config.toml"))
+    task = config.get_task("proof", tmp_path / "log")
+    src_path = tmp_path / "source.txt"
+    src_path.write_text(SOURCE_TEXT)
+    for i in range(2):
+        (works, _) = copyaid.cli.make_works([src_path], tmp_path)
+        assert copyaid.cli.do_works(task, works, 1) == 0
+    task.close()
+    assert CountingApi.num_queries == 2
+
+
+def test_batch(tmp_path):
+    import json
+
+    src_path = tmp_path / "source.md"
+    src_path.write_text("<!-- copybreak -->\n".join(["One.\n", "Two.\n", "One.\n"]))
+    config = ["--config", "tests/mock_config.toml"]
+    batch_path = tmp_path / "batch.jsonl"
+    args = ["batch", "submit", "proof", str(src_path), "-o", str(batch_path)]
+    assert copyaid.cli.main(args + config) == 0
+    lines = [json.loads(line) for line in batch_path.read_text().splitlines()]
+    assert len(lines) == 2
+    # local stand-in for running the batch
+    results_path = tmp_path / "results.jsonl"
+    with open(results_path, "w") as file:
+        for line in lines:
+            content = line["body"]["messages"][1]["content"].upper()
+            body = dict(created=0, choices=[dict(message=dict(content=content))])
+            response = dict(status_code=200, body=body)
+            file.write(json.dumps(dict(custom_id=line["custom_id"], response=response)))
+            file.write("\n")
+    args = ["batch", "collect", "proof", str(src_path), "--results", str(results_path)]
+    args += ["--dest", str(tmp_path), "--no-cache"]
+    assert copyaid.cli.main(args + config) == 0
+    got = (tmp_path / "R1" / "source.md").read_text()
+    assert got == "<!-- copybreak -->\n".join(["ONE.\n", "TWO.\n", "ONE.\n"])
+
+
+def test_estimate(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", CountingApi)
+    CountingApi.num_queries = 0
+    src_path = tmp_path / "source.md"
+    src_path.write_text("<!-- copybreak -->\n".join(["One.\n", "Two.\n", "One.\n"]))
+    retcode = copyaid.cli.main([
+        "proof",
+        str(src_path),
+        "--config", "tests/mock_config.toml",
+        "--estimate",
+    ])
+    assert retcode == 0
+    assert CountingApi.num_queries == 0
+    out = capsys.readouterr().out
+    assert "Requests: 2 (1 duplicates not sent)" in out
+    assert "Cost: $" in out
+    assert "source.0" in out
+
+
+def test_estimate_async(tmp_path, capsys):
+    config_path = tmp_path / "copyaid.toml"
+    mock_config = Path("tests/mock_config.toml").read_text()
+    config_path.write_text(
+        "max_concurrent_requests = 4\n[http]\nasync = true\nmax_connections = 1\n"
+        + mock_config.replace('"../copyaid/', f'"{Path.cwd()}/copyaid/')
+    )
+    src_path = tmp_path / "source.md"
+    src_path.write_text("<!-- copybreak -->\n".join(["One.\n", "Two.\n"]))
+    args = ["proof", str(src_path), "--config", str(config_path), "--estimate"]
+    assert copyaid.cli.main(args) == 0
+    assert "(limited by concurrency 1)" in capsys.readouterr().out
+
+
+class HttpEchoUpperApi(EchoUpperApi):
+    def __init__(self, api_key, http=None):
+        super().__init__(api_key)
+
+
+class AsyncEchoUpperApi(HttpEchoUpperApi):
+    async def query(self, req):
+        await asyncio.sleep(0.01)
+        return super().query(req)
+
+
+@pytest.mark.parametrize("api_class", [HttpEchoUpperApi, AsyncEchoUpperApi])
+def test_async_proxy(tmp_path, cache_home, monkeypatch, api_class):
+    monkeypatch.setattr(copyaid.core.ApiProxy, "ApiClass", api_class)
+    copybreak = "<!-- copybreak -->\n"
+    src_text = copybreak.join(f"Segment {i}.\n" for i in range(50))
+    config = "[http]\nasync = true\nmax_connections = 8\n"
+    got = run_task_with_config(tmp_path, "source.md", src_text, config)
+    assert got == copybreak.join(f"SEGMENT {i}.\n" for i in range(50))
+    assert len(list((cache_home / "copyaid/responses").iterdir())) == 50
@@ -3,6 +3,7 @@ import pytest
 import copyaid.diff
 from copyaid.diff import diffadapt
 
+import difflib, random
 from os import listdir
 from pathlib import Path
 
@@ -68,17 +69,40 @@ def read_text_files(subcase_dir):
     return ret 
 
 
+@pytest.mark.parametrize("engine", copyaid.diff.ENGINES)
 @pytest.mark.parametrize("case", listdir(CASES_DIR / "diff"))
-def test_diffadapt(case):
+def test_diffadapt(case, engine):
     txt = read_text_files(CASES_DIR / "diff" / case)
     #print_operations(txt["orig"], txt["revised"])
-    got = diffadapt(txt["orig"], [txt["revised"]])[0]
+    got = diffadapt(txt["orig"], [txt["revised"]], engine=engine)[0]
     assert got == txt["expected"]
 
 
+@pytest.mark.parametrize("engine", copyaid.diff.ENGINES)
 @pytest.mark.parametrize("case", listdir(CASES_DIR / "undo"))
-def test_diffadapt_undo(case):
+def test_diffadapt_undo(case, engine):
     txt = read_text_files(CASES_DIR / "undo" / case)
     #print_operations(txt["orig"], txt["revised"])
-    got = diffadapt(txt["orig"], [txt["revised"]])[0]
+    got = diffadapt(txt["orig"], [txt["revised"]], engine=engine)[0]
     assert got == txt["orig"]
+
+
+def test_automaton_same_as_difflib():
+    random.seed(0)
+    isjunk = lambda x: x == " "
+    words = ["a", "the", "gas", "big", " ", " ", ",", ".", "\n"]
+    for trial in range(500):
+        a = random.choices(words, k=random.randint(0, 30))
+        b = random.choices(words, k=random.randint(0, 30))
+        expected = difflib.SequenceMatcher(isjunk, a, b, autojunk=False)
+        matcher = copyaid.diff.AutomatonSequenceMatcher(isjunk)
+        matcher.set_seq2(b)
+        matcher.set_seq1(a)
+        assert matcher.get_opcodes() == expected.get_opcodes()
+
+
+def test_diffadapt_jobs():
+    txt = read_text_files(CASES_DIR / "diff" / "longish1")
+    revisions = [txt["revised"]] * 3
+    got = diffadapt(txt["orig"], revisions, jobs=2)
+    assert got == [txt["expected"]] * 3
@@ -0,0 +1,18 @@
+from copyaid.logwriter import QueryLogWriter
+
+from types import SimpleNamespace
+
+
+def test_log_bad_record(tmp_path, caplog):
+    def bad_dump(**kwargs):
+        raise TypeError("not serializable")
+
+    writer = QueryLogWriter(tmp_path, "jsonl")
+    good = SimpleNamespace(created=0, model_dump=lambda **kwargs: dict(created=0))
+    writer.put("good1", dict(), good)
+    writer.put("bad", dict(), SimpleNamespace(created=0, model_dump=bad_dump))
+    writer.put("good2", dict(), good)
+    writer.close()
+    lines = (tmp_path / "copyaid.jsonl").read_text().splitlines()
+    assert len(lines) == 2
+    assert "Logging bad failed" in caplog.text
@@ -0,0 +1,18 @@
+import pytest
+
+from copyaid.replay import replay_api_class
+
+import json, os
+
+
+def test_replay_log_order(tmp_path):
+    request = dict(messages=[])
+    for name, content in [("copyaid.2.jsonl", "old"), ("copyaid.1.jsonl", "new")]:
+        response = dict(choices=[dict(message=dict(content=content))])
+        record = dict(request=request, response=response)
+        (tmp_path / name).write_text(json.dumps(record) + "\n")
+        os.utime(tmp_path / name, ns=(0, 0))
+    replay = replay_api_class(tmp_path, strict=True)(None)
+    assert replay.query(request).choices[0].message.content == "new"
+    with pytest.raises(ValueError):
+        replay_api_class(tmp_path / "missing")
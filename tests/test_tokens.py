@@ -0,0 +1,40 @@
+import pytest
+
+from copyaid import tokens
+from copyaid.core import PromptSettings, split_chunks
+
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+PROOFREAD_SETTINGS = Path("copyaid/config/proofread.toml").resolve()
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    tokens.get_encoding.cache_clear()
+    tokens.count_tokens.cache_clear()
+    yield
+    tokens.get_encoding.cache_clear()
+    tokens.count_tokens.cache_clear()
+
+
+def test_token_counting(monkeypatch):
+    words = SimpleNamespace(encode=lambda text, **kwargs: text.split())
+    fake = SimpleNamespace(encoding_for_model=lambda model: words)
+    monkeypatch.setitem(sys.modules, "tiktoken", fake)
+    settings = PromptSettings(PROOFREAD_SETTINGS)
+    request = settings.make_openai_request("word " * 100)
+    assert request["max_tokens"] == int(settings.max_tokens_ratio * 100)
+    texts = split_chunks("word " * 100, 100, settings.model)
+    assert texts == ["word " * 100]
+    assert tokens.count_tokens.cache_info().hits == 1
+
+
+def test_token_counting_offline(monkeypatch):
+    def encoding_for_model(model):
+        raise ConnectionError("no network")
+
+    fake = SimpleNamespace(encoding_for_model=encoding_for_model)
+    monkeypatch.setitem(sys.modules, "tiktoken", fake)
+    assert tokens.estimate_text_tokens("word " * 100) == 125